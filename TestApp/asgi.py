@@ -0,0 +1,4 @@
+"""The ASGI entry point of the asyncio application (async_main.py): hypercorn -c file:hypercorn.conf.py asgi:app"""
+from async_main import create_app
+
+app = create_app()
@@ -0,0 +1,578 @@
+"""The asyncio version of the test, student and course routes of main.py, for serving many open connections (such as
+proctor tablets polling GET /test) without a thread per request. It runs on Quart and Motor, under an ASGI server
+(see asgi.py and hypercorn.conf.py), and answers every route it serves exactly like main.py: the same schemas,
+status codes, bodies, ETags and caches are used, and the data versions are shared with main.py through the
+versions collection.
+
+It also serves the login flow, whose calls to Microsoft run in a thread pool of their own (see login_pool), so that
+a burst of logins waiting on Microsoft does not hold up the other routes. The bulk upload and the administration
+routes are only served by main.py, which can run next to this application on the same database.
+"""
+####################  Setting Up  #######################
+# importing libraries
+from quart import Quart, Blueprint, request, redirect, make_response, Response, g
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne, WriteConcern, ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from marshmallow import ValidationError
+from functools import wraps
+from flask_cors.core import get_cors_options, get_cors_headers
+from os import environ, getpid
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import threading
+import asyncio
+import json
+import time
+
+import main
+from main import (LazyCollection, test_creation_schema, test_update_schema, test_update_time_schema,
+                  student_creation_schema, student_update_schema, student_extra_time_schema, course_creation_schema,
+                  course_update_schema, id_schema, roster_update_schema, test_student_start_time_schema,
+                  STREAM_BATCH_SIZE, dumps_json, flatten_oid, get_projection, get_page, make_page, get_etag,
+                  get_cache_key, load_body, query_cache, session_cache,
+                  get_test_filter, get_student_filter, get_course_filter, MAX_BATCH_SIZE, Batch, load_batch,
+                  build_batch, add_write_errors, batch_response, new_test, new_student, new_course,
+                  get_ids, delete_response, get_roster_cleanup, get_test_roster_write, ROSTER_WRITE_ATTEMPTS,
+                  get_test_start_time_write, get_course_roster_update, get_extra_time_writes, profile_cache,
+                  request_access_token, request_user_info, get_consent_form_location, get_state_error, new_session,
+                  set_session_cookie, record_versions, get_version_bump, record_version_bump,
+                  get_session_cache_entry, get_live_role)
+
+# Like the MongoClient of main.py, the Motor client is created on first use by each process
+client = None
+client_pid = None
+
+
+def get_db():
+    """Returns the testApp database, on the Motor client of the current process."""
+    global client, client_pid
+    if client is None or client_pid != getpid():
+        client = AsyncIOMotorClient(main.mongodb_host, main.mongodb_port,
+                                    username=main.mongodb_username, password=main.mongodb_password)
+        client_pid = getpid()
+    return client.testApp
+
+
+# getting the collections of the database, whose methods return awaitables
+collectionTests = LazyCollection("tests", get_db)
+collectionStudents = LazyCollection("users", get_db)
+collectionCourses = LazyCollection("courses", get_db)
+collectionOAuthStates = LazyCollection("oauthStates", get_db)
+collectionSessions = LazyCollection("sessions", get_db)
+collectionVersions = LazyCollection("versions", get_db)
+
+api = Blueprint("api", __name__)
+
+
+####################  Helper Methods  #######################
+
+versions_synced_at = None
+
+
+def json_response(obj, status=200):
+    """The Quart version of main.json_response."""
+    return Response(dumps_json(obj), status, mimetype="application/json")
+
+
+def validated(schema, allow_partial=False, allow_many=False):
+    """The asyncio version of main.validated."""
+    def decorator(route):
+        @wraps(route)
+        async def validate_and_call(**kwargs):
+            body = await request.get_json()
+            if allow_many and isinstance(body, list):
+                if not body:
+                    return json.dumps({"error": "The batch is empty"}), 400
+                if len(body) > MAX_BATCH_SIZE:
+                    return json.dumps({"error": f"At most {MAX_BATCH_SIZE} items can be sent at once"}), 400
+                return await route(load_batch(schema, body), **kwargs)
+            try:
+                data = load_body(schema, body, request.args, allow_partial)
+            except ValidationError:
+                return '', 400  # bad request
+            return await route(data, **kwargs)
+        return validate_and_call
+    return decorator
+
+
+async def insert_batch(collection, batch, build, duplicate_error=None):
+    """The asyncio version of main.insert_batch."""
+    documents = build_batch(batch, build)
+    errors = dict(batch.errors)
+    if documents:
+        try:
+            await collection.insert_many(list(documents.values()), ordered=False)
+        except BulkWriteError as err:
+            add_write_errors(errors, err, list(documents), duplicate_error)
+        await bump_version(collection)
+    return batch_response(batch, documents, errors)
+
+
+async def get_version(collection):
+    """The asyncio version of main.get_version, sharing its copy of the versions."""
+    global versions_synced_at
+    now = time.monotonic()
+    if versions_synced_at is None or now - versions_synced_at >= main.VERSION_SYNC_INTERVAL:
+        record_versions(await collectionVersions.find().to_list(None))
+        versions_synced_at = now
+    return main.collection_versions.get(collection.name, ("", 0))
+
+
+async def bump_version(*collections):
+    """The asyncio version of main.bump_version."""
+    for collection in collections:
+        doc = await collectionVersions.find_one_and_update(*get_version_bump(collection), upsert=True,
+                                                           return_document=ReturnDocument.AFTER)
+        record_version_bump(collection, doc)
+
+
+async def find_documents(collection, query_filter):
+    """The asyncio version of main.find_documents."""
+    version = await get_version(collection)
+    etag = get_etag(collection, version, request.query_string)
+    if request.if_none_match.contains(etag):
+        response = Response("", status=304)  # Not modified
+        response.set_etag(etag)
+        return response
+
+    streamed = request.args.get("stream") == "true"
+    cache_key = get_cache_key(collection, version, query_filter, request.args)
+    body = None if streamed else query_cache.get(cache_key)
+    if body is not None:
+        response = Response(body, 200, mimetype="application/json")  # OK
+    else:
+        response = await query_documents(collection, query_filter)
+        if response.status_code == 200 and not streamed:
+            query_cache.set(cache_key, await response.get_data())
+
+    if response.status_code == 200:
+        response.set_etag(etag)
+    return response
+
+
+async def query_documents(collection, query_filter):
+    """The asyncio version of main.query_documents."""
+    try:
+        projection = get_projection(collection, request.args)
+        page = get_page(request.args, query_filter)
+    except ValueError as err:
+        return Response(json.dumps({"error": str(err)}), 400)  # bad request
+
+    if page is None:
+        cursor = collection.find(query_filter, projection)
+        if request.args.get("stream") == "true":
+            return stream_documents(cursor)
+        # removes the $oid from each _id to simplify the processes for the frontend
+        return json_response([flatten_oid(doc) async for doc in cursor])  # OK
+
+    limit, page_filter = page
+    # one extra document is fetched to know whether there is a next page
+    data = await collection.find(page_filter, projection).sort("_id", ASCENDING).limit(limit + 1).to_list(None)
+    return json_response(make_page(data, limit))  # OK
+
+
+def stream_documents(cursor):
+    """The asyncio version of main.stream_documents."""
+    async def generate():
+        yield b"["
+        chunk = []
+        separator = b""
+        async for doc in cursor.batch_size(STREAM_BATCH_SIZE):
+            chunk.append(dumps_json(flatten_oid(doc)))
+            if len(chunk) == STREAM_BATCH_SIZE:
+                yield separator + b",".join(chunk)
+                chunk = []
+                separator = b","
+        if chunk:
+            yield separator + b",".join(chunk)
+        yield b"]"
+
+    return Response(generate(), 200, mimetype="application/json")  # OK
+
+
+####################  Managing the test database  #######################
+
+@api.route("/test", methods=['POST'])
+@validated(test_creation_schema, allow_many=True)
+async def add_test(data):
+    """The asyncio version of main.add_test."""
+    if isinstance(data, Batch):
+        return await insert_batch(collectionTests, data, new_test)
+
+    await collectionTests.insert_one(new_test(data))
+
+    await bump_version(collectionTests)
+    return '', 201  # created
+
+
+@api.route("/test", methods=['DELETE'])
+@validated(id_schema)
+async def delete_test(data):
+    """The asyncio version of main.delete_test."""
+    result = await collectionTests.delete_many({"_id": {"$in": get_ids(data)}})
+    await bump_version(collectionTests)
+    return delete_response(data, result.deleted_count)
+
+
+@api.route("/test", methods=['PATCH'])
+@validated(test_update_schema, allow_partial=True)
+async def update_test(data):
+    """The asyncio version of main.update_test."""
+    test_id = data.pop("_id")
+    if not data:
+        return '', 400  # bad request, nothing to update
+
+    result = await collectionTests.update_one({"_id": test_id}, {"$set": data})
+    if result.matched_count == 0:
+        return '', 404  # Not found
+    await bump_version(collectionTests)
+    return '', 200  # OK
+
+
+@api.route("/test/start", methods=['PATCH'])
+@validated(test_update_time_schema)
+async def update_testStartTime(data):
+    """The asyncio version of main.update_testStartTime."""
+    await collectionTests.update_one({"_id": data["_id"]}, {"$set": {"startTime": data["startTime"]}})
+    await bump_version(collectionTests)
+    return '', 200  # OK
+
+
+async def write_test_roster(test_id, build):
+    """The asyncio version of main.write_test_roster."""
+    for _ in range(ROSTER_WRITE_ATTEMPTS):
+        test = await collectionTests.find_one({"_id": test_id}, {"students": 1, "startTime": 1})
+        if test is None:
+            return 404  # Not found
+        write = build(test)
+        if write is None:
+            return None
+        if (await collectionTests.update_one(*write)).matched_count:
+            await bump_version(collectionTests)
+            return 200  # OK
+    return 409  # Conflict
+
+
+@api.route("/test/students", methods=['PATCH'])
+@validated(roster_update_schema)
+async def update_test_students(data):
+    """The asyncio version of main.update_test_students."""
+    status = await write_test_roster(data["_id"], lambda test: get_test_roster_write(test, data.get("remove", []),
+                                                                                     data.get("add", [])))
+    return '', status or 200  # OK if there was nothing to change
+
+
+@api.route("/test/students/start", methods=['PATCH'])
+@validated(test_student_start_time_schema)
+async def update_test_student_start_time(data):
+    """The asyncio version of main.update_test_student_start_time."""
+    status = await write_test_roster(data["_id"], lambda test: get_test_start_time_write(test, data["student"],
+                                                                                         data["startTime"]))
+    return '', status or 404  # Not found if the student is not on the test
+
+
+@api.route("/test", methods=['GET'])
+async def get_test():
+    """The asyncio version of main.get_test."""
+    try:
+        query_filter = get_test_filter(request.args)
+    except ValueError as err:
+        return json.dumps({"error": str(err)}), 400  # bad request
+    return await find_documents(collectionTests, query_filter)
+
+
+####################  Managing the student database  #######################
+
+@api.route("/students", methods=['POST'])
+@validated(student_creation_schema, allow_many=True)
+async def add_student(data):
+    """The asyncio version of main.add_student."""
+    if isinstance(data, Batch):
+        return await insert_batch(collectionStudents, data, new_student,
+                                  duplicate_error=("email", "A student with this email already exists"))
+
+    try:
+        await collectionStudents.insert_one(new_student(data))
+    except DuplicateKeyError:  # emails are unique in the student collection
+        return json.dumps({"error": "A student with this email already exists"}), 409  # Conflict
+    await bump_version(collectionStudents)
+    return '', 201  # Created
+
+
+async def remove_from_rosters(student_ids):
+    """The asyncio version of main.remove_from_rosters, with the same writes guarded on students and startTime."""
+    roster_filter, course_update = get_roster_cleanup(student_ids)
+    await collectionCourses.update_many(roster_filter, course_update)
+
+    for _ in range(ROSTER_WRITE_ATTEMPTS):
+        missed = 0
+        tests = collectionTests.find(roster_filter, {"students": 1, "startTime": 1})
+        while batch := await tests.to_list(MAX_BATCH_SIZE):
+            writes = [write for write in (get_test_roster_write(test, student_ids) for test in batch) if write]
+            if writes:
+                result = await collectionTests.bulk_write([UpdateOne(*write) for write in writes], ordered=False)
+                missed += len(writes) - result.matched_count
+        if not missed:
+            return
+    main.logger.warning("Some tests still list deleted students after %d attempts", ROSTER_WRITE_ATTEMPTS)
+
+
+@api.route("/students", methods=['DELETE'])
+@validated(id_schema)
+async def delete_student(data):
+    """The asyncio version of main.delete_student."""
+    student_ids = get_ids(data)
+    result = await collectionStudents.delete_many({"_id": {"$in": student_ids}})
+    await remove_from_rosters(student_ids)
+    await bump_version(collectionStudents, collectionTests, collectionCourses)
+    return delete_response(data, result.deleted_count)
+
+
+@api.route("/students", methods=['PATCH'])
+@validated(student_update_schema, allow_partial=True)
+async def update_student(data):
+    """The asyncio version of main.update_student."""
+    student_id = data.pop("_id")
+    if not data:
+        return '', 400  # Bad request, nothing to update
+
+    try:
+        result = await collectionStudents.update_one({"_id": student_id}, {"$set": data})
+    except DuplicateKeyError:  # emails are unique in the student collection
+        return json.dumps({"error": "A student with this email already exists"}), 409  # Conflict
+    if result.matched_count == 0:
+        return '', 404  # Not found
+    await bump_version(collectionStudents)
+    return '', 200  # OK
+
+
+@api.route("/students/extraTime", methods=['PATCH'])
+@validated(student_extra_time_schema)
+async def update_student_extraTime(data):
+    """The asyncio version of main.update_student_extraTime."""
+    rows = data["arrayStudents"]
+    emails = list(set(row["email"] for row in rows))
+
+    current = {}
+    async for doc in collectionStudents.find({"email": {"$in": emails}}, {"_id": 0, "email": 1, "extraTime": 1}):
+        current[doc["email"]] = doc.get("extraTime")
+
+    row_counts, operations = get_extra_time_writes(rows, current)
+
+    matched_count = 0
+    modified_count = 0
+    if operations:
+        bulk_result = await collectionStudents.bulk_write(operations, ordered=False)
+        matched_count = bulk_result.matched_count
+        modified_count = bulk_result.modified_count
+
+    await bump_version(collectionStudents)
+    return {"matched": matched_count, "modified": modified_count, "rows": row_counts}, 200  # OK
+
+
+@api.route("/students", methods=['GET'])
+async def get_student():
+    """The asyncio version of main.get_student."""
+    try:
+        query_filter = get_student_filter(request.args)
+    except ValueError as err:
+        return json.dumps({"error": str(err)}), 400  # bad request
+    return await find_documents(collectionStudents, query_filter)
+
+
+####################  Managing the course database  #######################
+
+@api.route("/course", methods=['POST'])
+@validated(course_creation_schema, allow_many=True)
+async def add_course(data):
+    """The asyncio version of main.add_course."""
+    if isinstance(data, Batch):
+        return await insert_batch(collectionCourses, data, new_course)
+
+    await collectionCourses.insert_one(new_course(data))
+
+    await bump_version(collectionCourses)
+    return '', 201  # Created
+
+
+@api.route("/course", methods=['DELETE'])
+@validated(id_schema)
+async def delete_course(data):
+    """The asyncio version of main.delete_course."""
+    result = await collectionCourses.delete_many({"_id": {"$in": get_ids(data)}})
+    await bump_version(collectionCourses)
+    return delete_response(data, result.deleted_count)
+
+
+@api.route("/course", methods=['PATCH'])
+@validated(course_update_schema, allow_partial=True)
+async def update_course(data):
+    """The asyncio version of main.update_course."""
+    course_id = data.pop("_id")
+    if not data:
+        return '', 400  # bad request, nothing to update
+
+    result = await collectionCourses.update_one({"_id": course_id}, {"$set": data})
+    if result.matched_count == 0:
+        return '', 404  # Not found
+    await bump_version(collectionCourses)
+    return '', 200  # OK
+
+
+@api.route("/course/students", methods=['PATCH'])
+@validated(roster_update_schema)
+async def update_course_students(data):
+    """The asyncio version of main.update_course_students."""
+    course_updates = get_course_roster_update(data)
+    result = await collectionCourses.bulk_write([UpdateOne({"_id": data["_id"]}, update)
+                                                 for update in course_updates])
+    if result.matched_count == 0:
+        return '', 404  # Not found
+    await bump_version(collectionCourses)
+    return '', 200  # OK
+
+
+@api.route("/course", methods=['GET'])
+async def get_course():
+    """The asyncio version of main.get_course."""
+    try:
+        query_filter = get_course_filter(request.args)
+    except ValueError as err:
+        return json.dumps({"error": str(err)}), 400  # bad request
+    return await find_documents(collectionCourses, query_filter)
+
+
+####################  Authentication #######################
+
+async def get_session_role(session_token):
+    """The asyncio version of main.get_session_role, sharing its session_cache."""
+    session_cache.sync(await get_version(session_cache))
+    cached = session_cache.get(session_token)
+    if cached is None:
+        session = await collectionSessions.find_one({"session": session_token}, {"_id": 0, "role": 1, "createdAt": 1})
+        cached = get_session_cache_entry(session)
+        session_cache.set(session_token, cached)
+    return get_live_role(cached)
+
+
+@api.before_app_request
+async def check_session():
+    """The asyncio version of main.check_session."""
+    session_token = request.cookies.get("session")
+    g.role = await get_session_role(session_token) if session_token else None
+
+    if not main.auth_required or request.method == "OPTIONS" or request.endpoint is None:
+        return None
+    if request.endpoint in main.PUBLIC_ENDPOINTS:
+        return None
+    if g.role is None:
+        return json.dumps({"error": "Not logged in"}), 401  # Unauthorized
+    if g.role != "teacher" and request.method != "GET":
+        return json.dumps({"error": "Only teachers can change data"}), 403  # Forbidden
+    return None
+
+
+# The threads making the calls to Microsoft, which use the blocking HTTP session of main.py (with its retries,
+# timeouts and metrics). A login waiting on Microsoft only holds one of them, not the event loop; when they are all
+# busy, further logins wait for one without holding anything, so there is no LOGIN_CONCURRENCY limit here.
+login_pool = ThreadPoolExecutor(int(environ.get("LOGIN_THREADS") or 16), thread_name_prefix="login")
+
+
+async def call_in_login_pool(function, *args):
+    """Runs a blocking call to Microsoft in login_pool.
+
+    :param function: The function making the call.
+    :param args: Its arguments.
+    :return: What the function returns.
+    """
+    return await asyncio.get_running_loop().run_in_executor(login_pool, function, *args)
+
+
+@api.route("/entra-id/flow", methods=['GET'])
+async def get_consent_form_url():
+    """The asyncio version of main.get_consent_form_url."""
+    state_token = str(uuid4())
+    await collectionOAuthStates.insert_one({
+        "state": state_token,
+        "status": "pending",
+        "createdAt": main.datetime.now(main.timezone.utc)  # the state token expires oauth_state_ttl seconds after this
+    })
+    return redirect(get_consent_form_location(state_token))
+
+
+@api.route("/entra-id/flow", methods=['POST'])
+async def authenticate_user():
+    """The asyncio version of main.authenticate_user and main.log_in_user. The calls to Microsoft are run in
+    login_pool, and logins are never turned away for being too many."""
+    body = await request.get_json()
+    state_token = body["state"]
+    expired_before = main.datetime.now(main.timezone.utc) - main.timedelta(seconds=main.oauth_state_ttl)
+    state = await collectionOAuthStates.find_one_and_update({
+        "state": state_token,
+        "status": "pending",
+        "createdAt": {"$gt": expired_before}
+    }, {"$set": {"status": "in-flight"}})
+    if state is None:
+        state = await collectionOAuthStates.find_one({"state": state_token}, {"status": 1, "createdAt": 1})
+        return json.dumps({"error": get_state_error(state, expired_before)}), 400
+
+    async def release_state():
+        """Puts the claimed state token back to pending after a failed login."""
+        await collectionOAuthStates.update_one({"state": state_token, "status": "in-flight"},
+                                               {"$set": {"status": "pending"}})
+
+    try:
+        access_token, user_id = await call_in_login_pool(request_access_token, body["code"])
+    except requests.exceptions.RequestException:
+        await release_state()
+        return json.dumps({"error": "Failed to authenticate user"}), 400
+
+    profile_cache.sync(await get_version(profile_cache))
+    user_info = profile_cache.get(user_id) if user_id is not None else None
+    if user_info is None:
+        try:
+            user_info = await call_in_login_pool(request_user_info, access_token)
+        except requests.exceptions.RequestException:
+            await release_state()
+            return json.dumps({"error": "Failed to get user info"}), 400
+        if user_id is not None:
+            profile_cache.set(user_id, user_info)
+
+    await collectionOAuthStates.with_options(write_concern=WriteConcern(w=0)).update_one(
+        {"state": state_token}, {"$set": {"status": "used"}})
+
+    session = new_session(user_info)
+    await collectionSessions.insert_one(session)
+    return set_session_cookie(await make_response("Logged in"), session)
+
+
+####################  Application  #######################
+
+def create_app():
+    """Creates the Quart application serving the routes of this module, with the same CORS headers as main.py, and
+    starts building the indexes in a background thread unless CREATE_INDEXES is "false".
+
+    :return: The Quart application.
+    """
+    app = Quart(__name__)
+    app.register_blueprint(api)
+
+    # Quart cannot use the Flask-CORS extension, but the headers are worked out by the same Flask-CORS functions
+    cors_options = get_cors_options(app, main.get_cors_settings())
+
+    @app.after_request
+    async def add_cors_headers(response):
+        for name, value in get_cors_headers(cors_options, request.headers, request.method).items():
+            response.headers.add(name, value)
+        return response
+
+    if environ.get("CREATE_INDEXES") != "false":
+        threading.Thread(target=main.bootstrap_indexes, name="index-bootstrap", daemon=True).start()
+    return app
+
+
+# Runs the application on Quart's development server (see hypercorn.conf.py for production)
+if __name__ == "__main__":
+    create_app().run(debug=environ.get("DEBUG") == "true", port=3000, host=environ.get("HOST") or "127.0.0.1")
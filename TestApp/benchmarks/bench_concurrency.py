@@ -0,0 +1,118 @@
+"""Load test: compares how the threaded application (main.py under gunicorn) and the asyncio application
+(async_main.py under hypercorn) handle many concurrent connections polling GET /test, as proctor tablets do.
+
+Both servers are started on this machine with one worker process each (and the threaded one with WEB_THREADS
+threads), with the query cache turned off so that every request reads from MongoDB. For each number of
+connections, every connection sends one request after the other over HTTP keep-alive for the given time, and the
+throughput and latency of each server are reported. Test documents with the course code BENCH are added for the
+run and deleted afterwards. MongoDB must be running (see MONGODB_HOST in the readme), and the packages of
+requirements-async.txt installed.
+
+Usage: python benchmarks/bench_concurrency.py [seconds per run] [connections ...]
+"""
+import sys
+import time
+import socket
+import asyncio
+import subprocess
+from os import environ, path
+
+from pymongo import MongoClient
+
+APP_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+POLL_PATH = "/test?courseCode=BENCH&view=summary&limit=50"
+SERVERS = {
+    "threaded (gunicorn gthread)": ["gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+    "asyncio (hypercorn)": ["hypercorn", "-c", "file:hypercorn.conf.py", "asgi:app"],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command, port):
+    env = dict(environ, HOST="127.0.0.1", PORT=str(port), WEB_WORKERS="1", QUERY_CACHE_SIZE="0",
+               CREATE_INDEXES="false", LOG_LEVEL="warning")
+    server = subprocess.Popen([sys.executable, "-m", *command], cwd=APP_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"{command[0]} did not start")
+
+
+async def poll(port, deadline, latencies, errors):
+    """Sends GET requests one after the other on a single keep-alive connection until the deadline."""
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        errors.append("connect")
+        return
+    request = f"GET {POLL_PATH} HTTP/1.1\r\nHost: bench\r\n\r\n".encode()
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            status = await reader.readline()
+            length = 0
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            if b" 200 " not in status:
+                errors.append(status.decode().strip())
+            latencies.append((time.perf_counter() - start) * 1000)
+    except (OSError, asyncio.IncompleteReadError):
+        errors.append("disconnected")
+    finally:
+        writer.close()
+
+
+async def run(port, connections, seconds):
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*(poll(port, deadline, latencies, errors) for _ in range(connections)))
+    latencies.sort()
+    if not latencies:
+        return f"no responses, errors {len(errors)}"
+    return (f"{len(latencies) / seconds:8.0f} req/s   p50 {latencies[len(latencies) // 2]:8.1f} ms   "
+            f"p99 {latencies[int(len(latencies) * 0.99)]:8.1f} ms   errors {len(errors)}")
+
+
+def main_benchmark(seconds, connection_counts):
+    client = MongoClient(environ.get("MONGODB_HOST") or "localhost", 27017,
+                         username=environ.get("MONGODB_USERNAME"), password=environ.get("MONGODB_PASSWORD"))
+    tests = client.testApp.tests
+    tests.insert_many([{
+        "testName": f"Bench test {i}", "courseCode": "BENCH", "calculator": False, "testLength": 60,
+        "notes": "", "students": [], "date": "2024-06-01", "period": i % 5 + 1, "startTime": [],
+        "teacherName": "Bench",
+    } for i in range(500)])
+
+    print(f"GET {POLL_PATH}, one worker process, {environ.get('WEB_THREADS') or 8} threads for gunicorn, "
+          f"{seconds} s per run")
+    try:
+        for name, command in SERVERS.items():
+            port = free_port()
+            server = start_server(command, port)
+            try:
+                for connections in connection_counts:
+                    print(f"{name:28} {connections:5} connections", asyncio.run(run(port, connections, seconds)))
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        tests.delete_many({"courseCode": "BENCH"})
+
+
+if __name__ == "__main__":
+    main_benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 10,
+                   [int(arg) for arg in sys.argv[2:]] or [10, 100, 1000])
@@ -0,0 +1,65 @@
+"""Compares the cost of turning GET /test results into a JSON response with the previous path (flatten_oid, then
+Flask's JSON provider) and with each encoder in JSON_ENGINES.
+
+No database is needed: the documents are built in memory in the shape get_test reads them from MongoDB.
+
+Usage: python benchmarks/bench_serialization.py [number of documents] [repeats]
+"""
+import sys
+import timeit
+from os import environ, path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+environ["CREATE_INDEXES"] = "false"  # the benchmark does not touch the database
+
+from bson.objectid import ObjectId
+import main
+
+app = main.create_app()
+
+
+def make_tests(count):
+    """Builds test documents with a roster of 30 students, as get_test reads them from the tests collection."""
+    return [{
+        "_id": ObjectId(),
+        "testName": f"Unit {i % 12} test",
+        "courseCode": f"MTH{i % 40}",
+        "calculator": i % 2 == 0,
+        "testLength": 75,
+        "notes": "Formula sheet allowed",
+        "students": [str(ObjectId()) for _ in range(30)],
+        "date": "2024-05-14",
+        "period": i % 5 + 1,
+        "startTime": [""] * 30,
+        "teacherName": "Ms. Example",
+    } for i in range(count)]
+
+
+def previous_path(docs):
+    with app.app_context():
+        return app.json.response([main.flatten_oid(dict(doc)) for doc in docs]).get_data()
+
+
+def engine_path(dumps):
+    def run(docs):
+        return main.Response(dumps([main.flatten_oid(dict(doc)) for doc in docs])).get_data()
+    return run
+
+
+def main_benchmark(count, repeats):
+    docs = make_tests(count)
+    paths = {"previous (flatten_oid + Flask JSON provider)": previous_path}
+    for name, dumps in main.JSON_ENGINES.items():
+        if name == "orjson" and main.orjson is None:
+            continue
+        paths[f"json_response ({name})"] = engine_path(dumps)
+
+    # flatten_oid changes the documents, so every run flattens shallow copies of them
+    print(f"{count} documents, best of {repeats} runs")
+    for name, run in paths.items():
+        best = min(timeit.repeat(lambda: run(docs), number=1, repeat=repeats))
+        print(f"{name:50} {best * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5000, int(sys.argv[2]) if len(sys.argv) > 2 else 5)
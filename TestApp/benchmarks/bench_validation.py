@@ -0,0 +1,54 @@
+"""Compares the per-request cost of validating a request body with a new schema instance built for each request (as
+the routes used to) and with the module-level schema singletons used by the validated decorator.
+
+No database is needed: only the validation is timed, on request bodies shaped like the ones the routes receive.
+
+Usage: python benchmarks/bench_validation.py [requests] [repeats]
+"""
+import sys
+import timeit
+from os import environ, path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+environ["CREATE_INDEXES"] = "false"  # the benchmark does not touch the database
+
+from bson.objectid import ObjectId
+import main
+
+TEST_BODY = {
+    "testName": "Unit 3 test",
+    "courseCode": "MTH1W",
+    "calculator": True,
+    "testLength": 75,
+    "notes": "Formula sheet allowed",
+    "students": [str(ObjectId()) for _ in range(30)],
+    "date": "2024-05-14",
+    "period": 2,
+    "teacherName": "Ms. Example",
+}
+STUDENT_UPDATE_BODY = {"_id": str(ObjectId()), "extraTime": 15}
+NO_ARGS = {}
+
+CASES = {
+    "POST /test": (main.TestCreationRequestBodySchema, main.test_creation_schema, TEST_BODY),
+    "PATCH /students?partial=true": (main.StudentUpdateRequestBodySchema, main.student_update_schema,
+                                     STUDENT_UPDATE_BODY),
+}
+
+
+def main_benchmark(requests, repeats):
+    print(f"{requests} requests, best of {repeats} runs, microseconds per request")
+    for name, (schema_class, singleton, body) in CASES.items():
+        args = {"partial": "true"} if "partial" in name else NO_ARGS
+        allow_partial = bool(args)
+        paths = {
+            "new schema per request": lambda: main.load_body(schema_class(), body, args, allow_partial),
+            "schema singleton": lambda: main.load_body(singleton, body, args, allow_partial),
+        }
+        for path_name, run in paths.items():
+            best = min(timeit.repeat(run, number=requests, repeat=repeats))
+            print(f"{name:30} {path_name:25} {best / requests * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000, int(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,201 @@
+"""Load test: measures the latency of a CRUD route (GET /test) while a storm of logins waits on a slow identity
+provider, on the threaded application (main.py, with and without the LOGIN_CONCURRENCY limit) and on the asyncio
+application (async_main.py, whose logins wait on the identity provider in its login thread pool).
+
+A mock identity provider (standing in for login.microsoftonline.com and graph.microsoft.com) answers every call
+after IDP_DELAY seconds. The threaded application is served by a WSGI server with a fixed number of worker threads,
+as in production, and the asyncio one by hypercorn, both in this process. The query cache is turned off, and the
+probes cycle through the periods of the test documents added for the run (with the course code BENCH, deleted
+afterwards), so every GET /test is a query to MongoDB. MongoDB must be running (see MONGODB_HOST in the readme), and
+the packages of requirements-async.txt installed.
+
+Usage: python benchmarks/load_login_storm.py [seconds per scenario]
+"""
+import sys
+import json
+import time
+import socket
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os import environ, path
+from urllib.parse import urlparse, parse_qs
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+import requests
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+IDP_DELAY = 1.0  # seconds the identity provider takes to answer each call
+APP_THREADS = 8  # worker threads of the application server
+LOGIN_CLIENTS = 40  # clients logging in over and over during the storm
+PROBE_CLIENTS = 4  # clients calling GET /test over and over
+PERIODS = 5  # the periods of the test documents, which the probes cycle through
+
+
+class MockIdentityProvider(BaseHTTPRequestHandler):
+    """Answers the token and Graph /me calls of the login flow, slowly."""
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, body):
+        time.sleep(IDP_DELAY)
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.reply({"access_token": "token"})
+
+    def do_GET(self):
+        self.reply({"jobTitle": "Teacher"})
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """A WSGI server handling requests on a fixed number of threads, like a threaded production server."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = ThreadPoolExecutor(APP_THREADS)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_servers():
+    idp = ThreadingHTTPServer(("127.0.0.1", 0), MockIdentityProvider)
+    threading.Thread(target=idp.serve_forever, daemon=True).start()
+    idp_url = f"http://127.0.0.1:{idp.server_address[1]}"
+    environ["ENTRA_LOGIN_URL"] = idp_url
+    environ["GRAPH_URL"] = idp_url
+    environ["QUERY_CACHE_SIZE"] = "0"
+    environ["CREATE_INDEXES"] = "false"
+
+    import main  # reads the identity provider URLs and the cache size when it is imported
+    import async_main
+    from hypercorn.config import Config
+    from hypercorn.asyncio import serve
+
+    wsgi_server = make_server("127.0.0.1", 0, main.create_app(),
+                              server_class=PooledWSGIServer, handler_class=QuietHandler)
+    wsgi_server.request_queue_size = 256
+    threading.Thread(target=wsgi_server.serve_forever, daemon=True).start()
+
+    asgi_port = free_port()
+    config = Config()
+    config.bind = [f"127.0.0.1:{asgi_port}"]
+    config.backlog = 256
+    asgi_app = async_main.create_app()
+    # a shutdown trigger is given as hypercorn can only handle the signals in the main thread
+    threading.Thread(target=asyncio.run, args=(serve(asgi_app, config, shutdown_trigger=asyncio.Event().wait),),
+                     daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", asgi_port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return main, f"http://127.0.0.1:{wsgi_server.server_address[1]}", f"http://127.0.0.1:{asgi_port}"
+
+
+def log_in_repeatedly(app_url, stop, statuses):
+    session = requests.Session()
+    while not stop.is_set():
+        try:
+            consent = session.get(f"{app_url}/entra-id/flow", allow_redirects=False, timeout=30)
+            state = parse_qs(urlparse(consent.headers["Location"]).query)["state"][0]
+            login = session.post(f"{app_url}/entra-id/flow", json={"state": state, "code": "code"}, timeout=30)
+            statuses.append(login.status_code)
+            if login.status_code == 503:
+                time.sleep(float(login.headers.get("Retry-After") or 1))
+        except requests.exceptions.RequestException:
+            statuses.append("error")
+
+
+def probe(app_url, stop, latencies):
+    session = requests.Session()
+    period = 0
+    while not stop.is_set():
+        period = period % PERIODS + 1
+        start = time.perf_counter()
+        try:
+            session.get(f"{app_url}/test?courseCode=BENCH&period={period}&limit=20", timeout=30)
+            latencies.append((time.perf_counter() - start) * 1000)
+        except requests.exceptions.RequestException:
+            latencies.append(float("inf"))
+        time.sleep(0.01)
+
+
+def run_scenario(app_url, seconds, storm):
+    stop = threading.Event()
+    latencies = []
+    statuses = []
+    threads = [threading.Thread(target=probe, args=(app_url, stop, latencies)) for _ in range(PROBE_CLIENTS)]
+    if storm:
+        threads += [threading.Thread(target=log_in_repeatedly, args=(app_url, stop, statuses))
+                    for _ in range(LOGIN_CLIENTS)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    summary = {status: statuses.count(status) for status in set(statuses)}
+    return (f"GET /test p50 {latencies[len(latencies) // 2]:8.1f} ms   "
+            f"p99 {latencies[int(len(latencies) * 0.99)]:8.1f} ms   "
+            f"({len(latencies)} requests)   logins {summary}")
+
+
+def main_load_test(seconds):
+    main, wsgi_url, asgi_url = start_servers()
+    main.collectionTests.insert_many([{
+        "testName": f"Bench test {i}", "courseCode": "BENCH", "calculator": False, "testLength": 60,
+        "notes": "", "students": [], "date": "2024-06-01", "period": i % PERIODS + 1, "startTime": [],
+        "teacherName": "Bench",
+    } for i in range(500)])
+
+    limit = main.login_concurrency
+    print(f"{APP_THREADS} worker threads, identity provider answering in {IDP_DELAY} s, "
+          f"{LOGIN_CLIENTS} clients logging in, {seconds} s per scenario, query cache off")
+    try:
+        print(f"{'threaded, no logins':36}", run_scenario(wsgi_url, seconds, storm=False))
+        main.login_slots = None
+        print(f"{'threaded, login storm, no limit':36}", run_scenario(wsgi_url, seconds, storm=True))
+        main.login_slots = threading.BoundedSemaphore(limit)
+        print(f"{f'threaded, login storm, limit of {limit}':36}", run_scenario(wsgi_url, seconds, storm=True))
+        print(f"{'asyncio, no logins':36}", run_scenario(asgi_url, seconds, storm=False))
+        print(f"{'asyncio, login storm':36}", run_scenario(asgi_url, seconds, storm=True))
+    finally:
+        main.collectionTests.delete_many({"courseCode": "BENCH"})
+
+
+if __name__ == "__main__":
+    main_load_test(float(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,22 @@
+"""Gunicorn configuration for running the application in production: gunicorn -c gunicorn.conf.py wsgi:app
+
+Gunicorn forks WEB_WORKERS worker processes, each serving requests on WEB_THREADS threads (the gthread worker).
+Each worker loads wsgi.py after it is forked, so it creates its own MongoClient and its own caches.
+"""
+from os import environ, cpu_count
+
+bind = f"{environ.get('HOST') or '0.0.0.0'}:{environ.get('PORT') or 3000}"
+worker_class = "gthread"
+workers = int(environ.get("WEB_WORKERS") or cpu_count() or 1)
+threads = int(environ.get("WEB_THREADS") or 8)
+
+# a request waiting on MongoDB or Microsoft longer than this has its worker restarted
+timeout = int(environ.get("WEB_TIMEOUT") or 60)
+keepalive = 5
+
+# the application must not be loaded before the fork, as MongoClient is not fork-safe
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
+loglevel = environ.get("LOG_LEVEL") or "info"
@@ -0,0 +1,19 @@
+"""Hypercorn configuration for running the asyncio application in production:
+hypercorn -c file:hypercorn.conf.py asgi:app
+
+Hypercorn starts WEB_WORKERS worker processes, each serving all of its connections from a single event loop.
+Each worker loads asgi.py when it starts, so it creates its own Motor client and its own caches.
+"""
+# Hypercorn reads every name of this file other than modules as a setting, so only modules are imported
+import os
+
+bind = [f"{os.environ.get('HOST') or '0.0.0.0'}:{os.environ.get('PORT') or 3000}"]
+workers = int(os.environ.get("WEB_WORKERS") or os.cpu_count() or 1)
+
+# connections waiting to be accepted, as thousands of clients may connect at once
+backlog = int(os.environ.get("WEB_BACKLOG") or 2048)
+keep_alive_timeout = 5
+
+accesslog = "-"
+errorlog = "-"
+loglevel = (os.environ.get("LOG_LEVEL") or "info").upper()
@@ -1,15 +1,38 @@
 ####################  Setting Up  #######################
 # importing libraries
-from flask import Flask, request, redirect, json, make_response
-from pymongo import MongoClient
+from flask import Flask, Blueprint, request, redirect, json, make_response, Response, stream_with_context, g
+from pymongo import MongoClient, ASCENDING, IndexModel, UpdateOne, WriteConcern, ReturnDocument
+from pymongo.errors import PyMongoError, DuplicateKeyError, OperationFailure, BulkWriteError
 import bson.objectid
 from bson.objectid import ObjectId
-from marshmallow import Schema, fields, ValidationError
+from bson.errors import InvalidId
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
 from flask_cors import CORS
-from os import environ
+from os import environ, getpid
 from dotenv import load_dotenv
 from uuid import uuid4
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import threading
+import logging
+import csv
+import io
+import base64
+import hashlib
+import hmac
+import time
+from collections import OrderedDict, deque
+import re
+from json import dumps as json_dumps
+from datetime import date, datetime, timedelta, timezone
+from itertools import batched, count
+from functools import wraps
+
+try:  # optional, a faster JSON encoder used for the GET routes when it is installed
+    import orjson
+except ImportError:
+    orjson = None
 
 load_dotenv()
 
@@ -19,19 +42,197 @@ mongodb_port = 27017
 mongodb_username = environ.get("MONGODB_USERNAME")
 mongodb_password = environ.get("MONGODB_PASSWORD")
 
-# initializing the connection to the MongoDB database and setting up a Flask application with CORS enabled
-client = MongoClient(mongodb_host, mongodb_port, username=mongodb_username, password=mongodb_password)
+# how long (in seconds) OAuth state tokens and login sessions are kept before MongoDB deletes them
+oauth_state_ttl = int(environ.get("OAUTH_STATE_TTL") or 600)
+session_ttl = int(environ.get("SESSION_TTL") or 43200)
 
-# getting the database and its collections
-db = client.testApp
-collectionTests = db.tests
-collectionStudents = db.users
-collectionCourses = db.courses
-collectionOAuthStates = db.oauthStates
-collectionSessions = db.sessions
+# The MongoClient is created on first use by each process rather than when this module is imported. MongoClient is
+# not fork-safe, and a pre-fork server (see gunicorn.conf.py) forks its workers after loading the application, so
+# every worker has to open its own connections. A client created before a fork is replaced in the child.
+client = None
+client_pid = None
+client_lock = threading.Lock()
 
-app = Flask(__name__)  # Initialize the Flask application
-cors = CORS(app)  # Enable CORS for the Flask app
+
+def get_client():
+    """Returns the MongoClient of the current process, creating it if this process does not have one yet.
+
+    :return: The MongoClient.
+    """
+    global client, client_pid
+    if client is None or client_pid != getpid():
+        with client_lock:
+            if client is None or client_pid != getpid():
+                client = MongoClient(mongodb_host, mongodb_port, username=mongodb_username, password=mongodb_password)
+                client_pid = getpid()
+    return client
+
+
+def get_db():
+    """Returns the testApp database, on the MongoClient of the current process."""
+    return get_client().testApp
+
+
+class LazyCollection:
+    """A collection of the testApp database that only creates the MongoClient when it is first used.
+
+    It forwards everything to the collection of the current process, so it is used exactly like one.
+    Its name is known without connecting, and it is hashable so that it can key INDEXES.
+
+    :param name: The name of the collection.
+    :param database: The function returning the database of the current process (get_db by default).
+    """
+
+    def __init__(self, name, database=None):
+        self.name = name
+        self.database_getter = database or get_db
+
+    def __getattr__(self, attr):
+        return getattr(self.database_getter()[self.name], attr)
+
+    def __eq__(self, other):
+        return isinstance(other, LazyCollection) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+# getting the collections of the database
+collectionTests = LazyCollection("tests")
+collectionStudents = LazyCollection("users")
+collectionCourses = LazyCollection("courses")
+collectionOAuthStates = LazyCollection("oauthStates")
+collectionSessions = LazyCollection("sessions")
+collectionVersions = LazyCollection("versions")
+
+# when true, every route other than the login flow needs a valid session cookie (see check_session)
+auth_required = environ.get("AUTH_REQUIRED") == "true"
+# the origins of the web pages allowed to call the API (comma-separated), which are sent the session cookie
+cors_origins = [origin.strip() for origin in (environ.get("CORS_ORIGINS") or "").split(",") if origin.strip()]
+# the SameSite attribute of the session cookie: "None" is needed if the front end is on another site than the API
+session_cookie_samesite = environ.get("SESSION_COOKIE_SAMESITE") or "Lax"
+
+# The routes are registered on this blueprint, and create_app builds the Flask application serving them
+api = Blueprint("api", __name__)
+logger = logging.getLogger(__name__)
+
+
+####################  Indexes  #######################
+
+# The indexes each route relies on, declared per collection. Every index is named so that it can be
+# compared against what already exists in the database when checking for missing or unused indexes.
+# The indexes used by the GET filters end with _id, which is the order the pages of a paginated GET follow.
+INDEXES = {
+    collectionTests: [
+        # get_test filters on any combination of courseCode, date and period
+        IndexModel([("courseCode", ASCENDING), ("date", ASCENDING), ("period", ASCENDING), ("_id", ASCENDING)],
+                   name="courseCode_date_period_id"),
+        IndexModel([("testName", ASCENDING), ("_id", ASCENDING)], name="testName_id"),
+    ],
+    collectionStudents: [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id"),
+    ],
+    collectionCourses: [
+        IndexModel([("courseName", ASCENDING), ("_id", ASCENDING)], name="courseName_id"),
+    ],
+    collectionOAuthStates: [
+        IndexModel([("state", ASCENDING)], name="state_unique", unique=True),
+        # MongoDB deletes state tokens oauth_state_ttl seconds after they were created
+        IndexModel([("createdAt", ASCENDING)], name="createdAt_ttl", expireAfterSeconds=oauth_state_ttl),
+    ],
+    collectionSessions: [
+        IndexModel([("session", ASCENDING)], name="session_unique", unique=True),
+        IndexModel([("createdAt", ASCENDING)], name="createdAt_ttl", expireAfterSeconds=session_ttl),
+    ],
+}
+
+# The collections whose documents expire, which are given a createdAt on startup if they were stored without one
+EXPIRING_COLLECTIONS = (collectionOAuthStates, collectionSessions)
+INDEX_OPTIONS_CONFLICT = 85  # the error code when an index exists with the same name but other options
+
+
+def ensure_indexes():
+    """Creates every index declared in INDEXES. Creating an index that already exists is a no-op in MongoDB,
+    so this is safe to run on every startup.
+
+    :return: A dictionary mapping each collection name to the error message of its failed index build, if any.
+    """
+    errors = {}
+    for collection, indexes in INDEXES.items():
+        try:
+            try:
+                collection.create_indexes(indexes)
+            except OperationFailure as err:
+                if err.code != INDEX_OPTIONS_CONFLICT:
+                    raise
+                update_ttl_indexes(collection, indexes)  # the configured lifetime of a TTL index has changed
+                collection.create_indexes(indexes)
+        except PyMongoError as err:  # e.g. duplicate emails already stored would block the unique index
+            errors[collection.name] = str(err)
+            logger.error("Could not create indexes on '%s': %s", collection.name, err)
+    return errors
+
+
+def update_ttl_indexes(collection, indexes):
+    """Changes the lifetime of the existing TTL indexes of a collection to the one declared in INDEXES.
+
+    :param collection: The collection the indexes belong to.
+    :param indexes: The declared indexes of the collection.
+    """
+    existing = collection.index_information()
+    for index in indexes:
+        name = index.document["name"]
+        if "expireAfterSeconds" in index.document and name in existing:
+            collection.database.command("collMod", collection.name, index={
+                "name": name,
+                "expireAfterSeconds": index.document["expireAfterSeconds"],
+            })
+
+
+def backfill_created_at():
+    """Gives a createdAt of now to the documents of EXPIRING_COLLECTIONS stored before they had one, so that
+    the TTL indexes (which ignore documents without the field) also expire them.
+    """
+    now = datetime.now(timezone.utc)
+    for collection in EXPIRING_COLLECTIONS:
+        collection.update_many({"createdAt": {"$exists": False}}, {"$set": {"createdAt": now}})
+
+
+def index_report():
+    """Compares the declared indexes with the ones in the database.
+
+    :return: A dictionary keyed by collection name listing the declared indexes that are missing, and the
+             indexes that exist but have not been used since the server started (according to $indexStats).
+    """
+    report = {}
+    for collection, indexes in INDEXES.items():
+        declared = [index.document["name"] for index in indexes]
+        existing = collection.index_information()
+        unused = []
+        for stats in collection.aggregate([{"$indexStats": {}}]):
+            if stats["name"] != "_id_" and stats["accesses"]["ops"] == 0:
+                unused.append(stats["name"])
+
+        report[collection.name] = {
+            "missing": [name for name in declared if name not in existing],
+            "unused": sorted(unused),
+        }
+    return report
+
+
+def bootstrap_indexes():
+    """Builds the indexes and logs any that are still missing afterwards. Runs in a background thread so
+    that a slow index build never delays the application from starting.
+    """
+    try:
+        ensure_indexes()
+        backfill_created_at()
+        for name, status in index_report().items():
+            if status["missing"]:
+                logger.warning("Collection '%s' is missing indexes: %s", name, ", ".join(status["missing"]))
+    except PyMongoError as err:
+        logger.error("Index bootstrap failed: %s", err)
 
 
 ####################  Helper Methods  #######################
@@ -45,7 +246,61 @@ def handle_object_id(obj):
     """
     if isinstance(obj, bson.ObjectId):
         return str(obj)
-    return TypeError
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_default(obj):
+    """This method converts the values that JSON does not support into strings. It is called by the JSON encoders
+    for every such value, at any depth of the document being encoded.
+
+    :param obj: The object to be converted
+    :return: The ISO 8601 string of a date or datetime, or the string of an ObjectId
+    :raise: TypeError if the obj cannot be converted.
+    """
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    return handle_object_id(obj)
+
+
+def dumps_stdlib(obj):
+    """Encodes obj as compact JSON with the standard library's (C accelerated) encoder.
+
+    :param obj: The object to be encoded
+    :return: The JSON as UTF-8 bytes
+    """
+    return json_dumps(obj, default=json_default, separators=(",", ":")).encode()
+
+
+def dumps_orjson(obj):
+    """Encodes obj as compact JSON with orjson, which handles dates natively and only calls json_default for
+    ObjectIds.
+
+    :param obj: The object to be encoded
+    :return: The JSON as UTF-8 bytes
+    """
+    return orjson.dumps(obj, default=json_default)
+
+
+# The encoders the GET routes can use, chosen with the JSON_ENGINE environment variable.
+# orjson is used by default when it is installed.
+JSON_ENGINES = {
+    "json": dumps_stdlib,
+    "orjson": dumps_orjson,
+}
+JSON_ENGINE = environ.get("JSON_ENGINE") or ("orjson" if orjson is not None else "json")
+if JSON_ENGINE == "orjson" and orjson is None:
+    raise RuntimeError("JSON_ENGINE is set to orjson, but orjson is not installed")
+dumps_json = JSON_ENGINES[JSON_ENGINE]
+
+
+def json_response(obj, status=200):
+    """Creates a JSON response with the encoder chosen by JSON_ENGINE.
+
+    :param obj: The object to be returned, which may contain ObjectIds and dates at any depth
+    :param status: The status code of the response
+    :return: The response
+    """
+    return Response(dumps_json(obj), status, mimetype="application/json")
 
 
 def flatten_oid(obj):
@@ -60,29 +315,694 @@ def flatten_oid(obj):
     return obj
 
 
+def parse_object_id(value):
+    """Reads an ObjectId given as a string in a query parameter.
+
+    :param value: The string.
+    :return: The ObjectId.
+    :raise: ValueError if the string is not a valid ObjectId.
+    """
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ValueError("Invalid _id")
+
+
+def parse_int(value, name):
+    """Reads an integer given as a string in a query parameter.
+
+    :param value: The string.
+    :param name: The name of the query parameter, for the error message.
+    :return: The integer.
+    :raise: ValueError if the string is not an integer.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}")
+
+
+PAGE_SIZE = int(environ.get("PAGE_SIZE") or 100)  # the page size when a next token is given without a limit
+MAX_PAGE_SIZE = int(environ.get("MAX_PAGE_SIZE") or 1000)
+
+
+def encode_page_token(last_id):
+    """Creates the opaque token given to the client to request the page after the given document.
+
+    :param last_id: The ObjectId of the last document of the current page.
+    :return: The token, as a URL-safe string.
+    """
+    return base64.urlsafe_b64encode(last_id.binary).decode()
+
+
+def decode_page_token(token):
+    """Reads a token created by encode_page_token.
+
+    :param token: The token given by the client.
+    :return: The ObjectId of the last document of the previous page.
+    :raise: ValueError if the token is not valid.
+    """
+    try:
+        return ObjectId(base64.urlsafe_b64decode(token.encode()))
+    except (InvalidId, TypeError, ValueError):
+        raise ValueError("Invalid page token")
+
+
+# Named projections that can be requested with the view query parameter of a GET route
+VIEWS = {
+    "tests": {
+        "summary": {"students": 0, "startTime": 0},  # a test without its roster
+    },
+    "courses": {
+        "summary": {"students": 0},  # a course without its roster
+    },
+}
+
+
+def get_projection(collection, args):
+    """Builds the projection of a GET route from its fields or view query parameter.
+    fields is a comma-separated list of the fields to return (the id is always returned), and view is the name of
+    one of the projections in VIEWS.
+
+    :param collection: The collection being queried.
+    :param args: The query parameters of the request.
+    :return: The projection, or None if every field should be returned.
+    :raise: ValueError if a field name or the view is invalid, or if both fields and view are given.
+    """
+    field_names = args.get("fields")
+    view = args.get("view")
+    if field_names is not None and view is not None:
+        raise ValueError("Only one of fields and view can be given")
+
+    if view is not None:
+        if view not in VIEWS.get(collection.name, {}):
+            raise ValueError(f"Unknown view '{view}'")
+        return VIEWS[collection.name][view]
+
+    if field_names is not None:
+        projection = {}
+        for name in field_names.split(","):
+            name = name.strip()
+            if not re.fullmatch(r"\w+", name):
+                raise ValueError(f"Invalid field '{name}'")
+            if name not in ("id", "_id"):  # the _id is always returned
+                projection[name] = 1
+        return projection or {"_id": 1}
+    return None
+
+
+STREAM_BATCH_SIZE = int(environ.get("STREAM_BATCH_SIZE") or 500)
+
+
+def stream_documents(cursor):
+    """Writes the documents of a cursor as a JSON array, one batch of documents at a time, while the cursor is
+    still fetching the rest. Only one batch of documents is held in memory at once.
+
+    :param cursor: The cursor of the query.
+    :return: A streamed response with the JSON array.
+    """
+    def generate():
+        yield b"["
+        chunk = []
+        separator = b""
+        for doc in cursor.batch_size(STREAM_BATCH_SIZE):
+            chunk.append(dumps_json(flatten_oid(doc)))
+            if len(chunk) == STREAM_BATCH_SIZE:
+                yield separator + b",".join(chunk)
+                chunk = []
+                separator = b","
+        if chunk:
+            yield separator + b",".join(chunk)
+        yield b"]"
+
+    return Response(stream_with_context(generate()), 200, mimetype="application/json")  # OK
+
+
+class TTLCache:
+    """A thread-safe, in-process cache that holds at most maxsize entries, each for at most ttl seconds.
+    When it is full, the least recently used entry is evicted.
+
+    :param maxsize: The maximum number of entries. A maxsize of 0 turns the cache off.
+    :param ttl: The number of seconds an entry is kept.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expiry time, value), from least to most recently used
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """:return: The value of the key, or None if it is not cached or has expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        """Caches the value of the key, evicting the least recently used entry if the cache is full."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Removes the key from the cache, if it is cached."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """Removes every key for which predicate(key) is true."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# The version of each collection's data, raised by every route that writes to it. The GET routes use it as their
+# ETag, so a client that already has the latest data gets a 304 Not Modified without the database being queried.
+# The versions are kept in the versions collection, so that they are shared by every worker process and survive
+# restarts. Each document holds a counter and a random epoch, given when it is created, so that the versions never
+# repeat after the collection is dropped. Each process keeps a copy, read again at most every VERSION_SYNC_INTERVAL
+# seconds: a write made through another worker is seen by this one within that time.
+VERSION_SYNC_INTERVAL = float(environ.get("VERSION_SYNC_INTERVAL") or 1)
+collection_versions = {}
+versions_synced_at = None
+versions_lock = threading.Lock()
+
+
+def set_version(name, epoch, counter):
+    """Records a version of a collection in collection_versions, unless a newer one of the same epoch is there.
+    Must be called with versions_lock held.
+
+    :param name: The name of the collection.
+    :param epoch: The epoch of the version.
+    :param counter: The counter of the version.
+    """
+    current = collection_versions.get(name)
+    if current is None or current[0] != epoch or current[1] < counter:
+        collection_versions[name] = (epoch, counter)
+
+
+def get_version(collection):
+    """Returns the version of the data of a collection, reading the versions collection again if this process's
+    copy is older than VERSION_SYNC_INTERVAL.
+
+    :param collection: The collection.
+    :return: The version, as an (epoch, counter) tuple. Collections never written to by the routes have no epoch.
+    """
+    global versions_synced_at
+    now = time.monotonic()
+    if versions_synced_at is None or now - versions_synced_at >= VERSION_SYNC_INTERVAL:
+        record_versions(collectionVersions.find())
+        versions_synced_at = now
+    return collection_versions.get(collection.name, ("", 0))
+
+
+def record_versions(docs):
+    """Records the versions read from the versions collection in collection_versions.
+
+    :param docs: The documents of the versions collection.
+    """
+    with versions_lock:
+        for doc in docs:
+            set_version(doc["_id"], doc["epoch"], doc["version"])
+
+
+def get_version_bump(collection):
+    """Builds the find_one_and_update of bump_version, which raises the version of a collection, giving it an epoch
+    if it has none yet.
+
+    :param collection: The collection that was written to.
+    :return: The filter and the update.
+    """
+    return {"_id": collection.name}, {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid4().hex}}
+
+
+def record_version_bump(collection, doc):
+    """Records the version raised by bump_version, and removes the cached responses of the older ones.
+
+    :param collection: The collection that was written to.
+    :param doc: The document of the collection in the versions collection, after the update.
+    """
+    with versions_lock:
+        set_version(collection.name, doc["epoch"], doc["version"])
+    query_cache.delete_matching(lambda key: key[0] == collection.name)
+
+
+def bump_version(*collections):
+    """Marks the data of the given collections as changed. Must be called after the write has completed.
+
+    :param collections: The collections that were written to.
+    """
+    for collection in collections:
+        doc = collectionVersions.find_one_and_update(*get_version_bump(collection), upsert=True,
+                                                     return_document=ReturnDocument.AFTER)
+        record_version_bump(collection, doc)
+
+
+class SharedCache(TTLCache):
+    """A TTLCache of which every worker process keeps its own copy, and which can be invalidated in all of them.
+    An invalidation raises the version of the cache's name in the versions collection (like a write to a collection,
+    see bump_version), and each process clears its copy once it sees a version it has not seen before, within
+    VERSION_SYNC_INTERVAL seconds.
+
+    :param name: The name of the cache in the versions collection.
+    :param maxsize: The maximum number of entries. A maxsize of 0 turns the cache off.
+    :param ttl: The number of seconds an entry is kept.
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        super().__init__(maxsize, ttl)
+        self.name = name
+        self.seen_version = None
+
+    def sync(self, version):
+        """Clears this process's copy if the cache was invalidated since it was last synced. Called before reading
+        the cache, with the version from get_version (or its asyncio version).
+
+        :param version: The current version of the cache.
+        """
+        if version != self.seen_version:
+            if self.seen_version is not None:
+                self.clear()
+            self.seen_version = version
+
+    def invalidate(self, key=None):
+        """Removes a key, or every key, from the cache. The other processes clear their whole copy.
+
+        :param key: The key to remove, or None to remove every key.
+        """
+        bump_version(self)
+        if key is None:
+            self.clear()
+        else:
+            self.delete(key)
+
+
+def get_etag(collection, version, query_string):
+    """Computes the ETag of a GET request, from the version of the collection it reads and its query string.
+    Every worker process computes the same ETag for the same version.
+
+    :param collection: The collection read by the request.
+    :param version: The version of the collection, read before the database is queried.
+    :param query_string: The query string of the request, as bytes.
+    :return: The ETag, without quotes.
+    """
+    epoch, counter = version
+    key = f"{collection.name}:{epoch}:{counter}:{JSON_ENGINE}:{query_string.decode()}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+class ResponseCache(TTLCache):
+    """A TTLCache of response bodies that is also bounded by their total size, so that a few large responses (such
+    as every test, unpaginated) cannot fill the memory of each worker process. When the bodies take more than maxbytes,
+    the least recently used ones are evicted, and a body larger than maxbytes is not cached at all.
+
+    :param maxsize: The maximum number of entries. A maxsize of 0 turns the cache off.
+    :param ttl: The number of seconds an entry is kept.
+    :param maxbytes: The maximum total size of the cached bodies, in bytes.
+    """
+
+    def __init__(self, maxsize, ttl, maxbytes):
+        super().__init__(maxsize, ttl)
+        self.maxbytes = maxbytes
+
+    def set(self, key, value):
+        """Caches the body of the key, evicting the least recently used entries while the cache is too full."""
+        if self.maxsize <= 0 or len(value) > self.maxbytes:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            size = sum(len(body) for _, body in self._entries.values())
+            while len(self._entries) > self.maxsize or size > self.maxbytes:
+                _, (_, body) = self._entries.popitem(last=False)
+                size -= len(body)
+
+
+# The encoded responses of the GET routes. Entries are keyed on the collection's version, so a write makes the
+# older entries unreachable, and bump_version also removes them straight away.
+query_cache = ResponseCache(int(environ.get("QUERY_CACHE_SIZE") or 256), float(environ.get("QUERY_CACHE_TTL") or 60),
+                            int(environ.get("QUERY_CACHE_BYTES") or 32 * 1024 * 1024))
+
+
+def get_cache_key(collection, version, query_filter, args):
+    """Creates the query_cache key of a GET request. Two requests asking for the same documents get the same key,
+    whatever the order of their query parameters.
+
+    :param collection: The collection read by the request.
+    :param version: The version of the collection, read before the database is queried.
+    :param query_filter: The filter built from the query parameters of the route.
+    :param args: The query parameters of the request.
+    :return: The key.
+    """
+    options = tuple((name, args.get(name)) for name in ("fields", "view", "limit", "next"))
+    return collection.name, version, json_dumps(query_filter, sort_keys=True, default=json_default), options
+
+
+def find_documents(collection, query_filter):
+    """Runs the query of a GET route and builds its response.
+
+    Without the limit and next query parameters, every matching document is returned in a JSON array.
+    With them, the documents are returned a page at a time, ordered by _id: the response is a JSON object with
+    the documents in "data" and, if there are more, the token to pass as the next query parameter in "next".
+    Each page starts right after the last _id of the previous one, so every page costs the same to fetch
+    however far into the collection it is.
+
+    The fields or view query parameter limits which fields of each document are returned (see get_projection).
+    Responses carry an ETag (see get_etag); when the If-None-Match header already has it, a 304 Not Modified is
+    returned without querying the database.
+    Other responses are served from query_cache while the collection has not changed (except streamed ones).
+
+    The documents are encoded by the JSON_ENGINE encoder, which also converts the ObjectIds and dates nested in
+    them. Without pagination, the stream query parameter set to "true" streams the JSON array as the documents are read
+    from the database instead of building it in memory first.
+
+    :param collection: The collection to query.
+    :param query_filter: The filter built from the query parameters of the route.
+    :return: The response of the GET route.
+    """
+    version = get_version(collection)
+    etag = get_etag(collection, version, request.query_string)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)  # Not modified
+        response.set_etag(etag)
+        return response
+
+    streamed = request.args.get("stream") == "true"
+    cache_key = get_cache_key(collection, version, query_filter, request.args)
+    body = None if streamed else query_cache.get(cache_key)
+    if body is not None:
+        response = Response(body, 200, mimetype="application/json")  # OK
+    else:
+        response = query_documents(collection, query_filter)
+        if response.status_code == 200 and not streamed:
+            query_cache.set(cache_key, response.get_data())
+
+    if response.status_code == 200:
+        response.set_etag(etag)
+    return response
+
+
+def query_documents(collection, query_filter):
+    """Queries the collection for find_documents.
+
+    :param collection: The collection to query.
+    :param query_filter: The filter built from the query parameters of the route.
+    :return: The response of the GET route.
+    """
+    try:
+        projection = get_projection(collection, request.args)
+        page = get_page(request.args, query_filter)
+    except ValueError as err:
+        return make_response(json.dumps({"error": str(err)}), 400)  # bad request
+
+    if page is None:
+        cursor = collection.find(query_filter, projection)
+        if request.args.get("stream") == "true":
+            return stream_documents(cursor)
+        # removes the $oid from each _id to simplify the processes for the frontend
+        return json_response([flatten_oid(doc) for doc in cursor])  # OK
+
+    limit, page_filter = page
+    # one extra document is fetched to know whether there is a next page
+    data = list(collection.find(page_filter, projection).sort("_id", ASCENDING).limit(limit + 1))
+    return json_response(make_page(data, limit))  # OK
+
+
+def get_page(args, query_filter):
+    """Reads the pagination query parameters (limit and next) of a GET route.
+
+    :param args: The query parameters of the request.
+    :param query_filter: The filter built from the query parameters of the route.
+    :return: The page size and the filter of the page (the documents after the next token), or None if the request
+             is not paginated.
+    :raise: ValueError if the limit or the next token is invalid.
+    """
+    limit = args.get("limit")
+    token = args.get("next")
+    if limit is None and token is None:
+        return None
+
+    limit = min(parse_int(limit, "limit") if limit else PAGE_SIZE, MAX_PAGE_SIZE)
+    if limit < 1:
+        raise ValueError("The limit must be positive")
+    if token is not None:
+        query_filter = {"$and": [query_filter, {"_id": {"$gt": decode_page_token(token)}}]}
+    return limit, query_filter
+
+
+def make_page(data, limit):
+    """Builds the body of a page from the documents fetched for it.
+
+    :param data: Up to limit + 1 documents, ordered by _id. The extra document only shows that there is a next page.
+    :param limit: The page size.
+    :return: The page, with the documents in "data" and the token of the next page (or None) in "next".
+    """
+    next_token = None
+    if len(data) > limit:
+        data = data[:limit]
+        next_token = encode_page_token(data[-1]["_id"])
+    return {"data": [flatten_oid(doc) for doc in data], "next": next_token}
+
+
+def load_body(schema, body, args, allow_partial=False):
+    """Validates a request body with a schema.
+
+    :param schema: The schema used to validate the request body.
+    :param body: The JSON request body.
+    :param args: The query parameters of the request.
+    :param allow_partial: Whether the query parameter partial=true can be used. The update schemas allow it, so
+                          that only the _id is required and the client may send just the fields that changed.
+    :return: The loaded data, with the types of the schema's fields (such as ObjectIds for the IDs).
+    :raise: ValidationError if the request body does not match the schema.
+    """
+    partial_fields = False
+    if allow_partial and args.get("partial") == "true":
+        partial_fields = tuple(name for name in schema.fields if name != "_id")
+    return schema.load(body, partial=partial_fields)
+
+
+def validated(schema, allow_partial=False, allow_many=False):
+    """Decorates a route so that its JSON request body is parsed and validated once, by one of the schema singletons,
+    before the route is called with the loaded data as its argument. Invalid request bodies get a 400 Bad Request
+    without the route being called.
+
+    :param schema: The schema used to validate the request body.
+    :param allow_partial: Whether the query parameter partial=true can be used (see load_body).
+    :param allow_many: Whether the request body can also be a JSON array of request bodies. The route is then called
+                       with a Batch instead, which holds the valid items and the errors of the others.
+    :return: The decorator.
+    """
+    def decorator(route):
+        @wraps(route)
+        def validate_and_call(**kwargs):
+            body = request.get_json()
+            if allow_many and isinstance(body, list):
+                if not body:
+                    return json.dumps({"error": "The batch is empty"}), 400
+                if len(body) > MAX_BATCH_SIZE:
+                    return json.dumps({"error": f"At most {MAX_BATCH_SIZE} items can be sent at once"}), 400
+                return route(load_batch(schema, body), **kwargs)
+            try:
+                data = load_body(schema, body, request.args, allow_partial)
+            except ValidationError:
+                return '', 400  # bad request
+            return route(data, **kwargs)
+        return validate_and_call
+    return decorator
+
+
+MAX_BATCH_SIZE = int(environ.get("MAX_BATCH_SIZE") or 1000)  # the most items a batch request body can have
+DUPLICATE_KEY = 11000  # the error code when a write is rejected by a unique index
+
+
+class Batch:
+    """The items of a batch request body (a JSON array of request bodies), validated together.
+
+    :param size: The number of items in the request body.
+    :param items: The loaded data of the valid items, by their index in the request body.
+    :param errors: The validation error messages of the other items, by their index in the request body.
+    """
+
+    def __init__(self, size, items, errors):
+        self.size = size
+        self.items = items
+        self.errors = errors
+
+
+def load_batch(schema, body):
+    """Validates every item of a batch request body with the schema, in a single load with many=True.
+
+    :param schema: The schema used to validate each item.
+    :param body: The JSON array.
+    :return: The Batch.
+    """
+    try:
+        return Batch(len(body), dict(enumerate(schema.load(body, many=True))), {})
+    except ValidationError as err:
+        # the loaded data of the items is kept in order, including the items that failed
+        items = {index: data for index, data in enumerate(err.valid_data) if index not in err.messages}
+        return Batch(len(body), items, err.messages)
+
+
+def insert_batch(collection, batch, build, duplicate_error=None):
+    """Inserts the valid items of a batch create in a single unordered insert_many, so that one failing document does
+    not stop the others.
+
+    :param collection: The collection to insert into.
+    :param batch: The Batch of the request.
+    :param build: The function building the document to insert from the loaded data of an item.
+    :param duplicate_error: The field and the message reported for an item rejected by a unique index.
+    :return: The response (see batch_response).
+    """
+    documents = build_batch(batch, build)
+    errors = dict(batch.errors)
+    if documents:
+        try:
+            collection.insert_many(list(documents.values()), ordered=False)
+        except BulkWriteError as err:
+            add_write_errors(errors, err, list(documents), duplicate_error)
+        bump_version(collection)
+    return batch_response(batch, documents, errors)
+
+
+def build_batch(batch, build):
+    """Builds the documents of the valid items of a batch create, each with a new _id so that the IDs are known even
+    if some of the inserts fail.
+
+    :param batch: The Batch of the request.
+    :param build: The function building the document to insert from the loaded data of an item.
+    :return: The documents, by the index of their item in the request body.
+    """
+    documents = {}
+    for index, data in batch.items.items():
+        documents[index] = build(data)
+        documents[index]["_id"] = ObjectId()
+    return documents
+
+
+def add_write_errors(errors, err, indexes, duplicate_error):
+    """Adds the documents rejected by an unordered insert_many to the errors of a batch create.
+
+    :param errors: The error messages of the batch, by the index of their item in the request body.
+    :param err: The BulkWriteError of the insert_many.
+    :param indexes: The index in the request body of each document that was sent, in the order they were sent.
+    :param duplicate_error: The field and the message reported for an item rejected by a unique index.
+    """
+    for write_error in err.details["writeErrors"]:
+        index = indexes[write_error["index"]]
+        if write_error["code"] == DUPLICATE_KEY and duplicate_error is not None:
+            errors[index] = {duplicate_error[0]: [duplicate_error[1]]}
+        else:
+            errors[index] = {"_schema": [write_error["errmsg"]]}
+
+
+def batch_response(batch, documents, errors):
+    """Creates the response of a batch create.
+
+    :param batch: The Batch of the request.
+    :param documents: The documents that were sent to the database, by the index of their item in the request body.
+    :param errors: The error messages of the items that were not inserted, by their index in the request body.
+    :return: A JSON with the ID of each inserted item in "ids" (null for the items that were not inserted) and the
+             error messages of the others in "errors", with 201 Created if every item was inserted, 207 Multi-Status
+             if only some were, or 400 Bad Request if none were.
+    """
+    ids = [str(documents[index]["_id"]) if index in documents and index not in errors else None
+           for index in range(batch.size)]
+    status = 201 if not errors else 207 if any(ids) else 400  # Created, Multi-Status or Bad request
+    return {"ids": ids, "errors": [{"index": index, "messages": errors[index]} for index in sorted(errors)]}, status
+
+
+def get_ids(data):
+    """Gives the IDs of the documents to delete, from a request body validated by the IdRequestBodySchema.
+
+    :param data: The loaded request body, with either an _id or a list of ids.
+    :return: The list of ObjectIds.
+    """
+    return data["ids"] if "ids" in data else [data["_id"]]
+
+
+def delete_response(data, deleted_count):
+    """Creates the response of a delete.
+
+    :param data: The loaded request body, with either an _id or a list of ids.
+    :param deleted_count: The number of documents deleted.
+    :return: An empty 200 OK when a single _id was given, or a JSON with the number of documents deleted when a list
+             of ids was given.
+    """
+    if "ids" in data:
+        return {"deleted": deleted_count}, 200  # OK
+    return '', 200  # OK
+
+
 ####################  Schemas  #######################
 
+class ObjectIdField(fields.Field):
+    """A field given as the string of an ObjectId, which is loaded as the ObjectId."""
+    default_error_messages = {"invalid": "Not a valid ObjectId."}
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        try:
+            return ObjectId(value)
+        except (InvalidId, TypeError):
+            raise self.make_error("invalid")
+
+
+class DateString(fields.Date):
+    """A date given in YYYY-MM-DD format, which is loaded as that string: dates are stored and filtered as strings."""
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        return super()._deserialize(value, attr, data, **kwargs).isoformat()
+
+
+class WholeNumber(fields.Integer):
+    """An integer, which can also be given as a string ("3") or a float without a fractional part (3.0). It is
+    loaded as an int; a number with a fractional part is rejected instead of being truncated."""
+
+    def _validated(self, value):
+        if isinstance(value, float) and not value.is_integer():
+            raise self.make_error("invalid", input=value)
+        return super()._validated(value)
+
+
 class TestCreationRequestBodySchema(Schema):
     """Schema for validating the request body when creating a new test.
 
     :param testName: The name of the test. Required.
     :param courseCode: The course code for which the test is being created. Required.
     :param calculator: Whether a calculator is permitted for the test. Required, should be a boolean value.
-    :param testLength: The length of the test in minutes. Required, should be a number.
+    :param testLength: The length of the test in minutes. Required, should be an integer.
     :param notes: Any additional notes or instructions for the test. Required.
-    :param students: A list of student IDs for whom the test is intended. Required, each ID should be a string.
-    :param date: The date of the test. Required, should be a date format.
-    :param period: The period or session for the test. Required, should be a number.
+    :param students: A list of student IDs for whom the test is intended. Required, each ID should be the string of an ObjectId.
+    :param date: The date of the test. Required, should be in YYYY-MM-DD format.
+    :param period: The period or session for the test. Required, should be an integer.
     :param teacherName: The name of the teacher creating the test. Required.
     """
     testName = fields.Str(required=True)
     courseCode = fields.Str(required=True)
     calculator = fields.Boolean(required=True)
-    testLength = fields.Number(required=True)
+    testLength = WholeNumber(required=True)
     notes = fields.Str(required=True)
-    students = fields.List(fields.Str, required=True)
-    date = fields.Date(required=True)
-    period = fields.Number(required=True)
+    students = fields.List(ObjectIdField, required=True)
+    date = DateString(required=True)
+    period = WholeNumber(required=True)
     teacherName = fields.Str(required=True)
 
 
@@ -93,47 +1013,71 @@ class TestUpdateRequestBodySchema(Schema):
     :param testName: The updated name of the test. Required.
     :param courseCode: The updated course code for which the test is being created. Required.
     :param calculator: Whether a calculator is allowed for the test. Required, should be a boolean value.
-    :param testLength: The updated length of the test in minutes. Required, should be a number.
+    :param testLength: The updated length of the test in minutes. Required, should be an integer.
     :param notes: Any additional notes or instructions for the test. Required.
-    :param students: A list of student IDs for whom the test is intended. Required, each ID should be a string.
-    :param date: The updated date of the test. Required, should be a date format.
-    :param period: The updated period or session for the test. Required, should be a number.
-    :param startTime: The updated start times of the test. Required, should be a list of strings.
+    :param students: A list of student IDs for whom the test is intended. Required, each ID should be the string of an ObjectId.
+    :param date: The updated date of the test. Required, should be in YYYY-MM-DD format.
+    :param period: The updated period or session for the test. Required, should be an integer.
+    :param startTime: The updated start times of the test, one for each student, in the same order. Required, should
+                      be a list of strings with as many items as students.
     :param teacherName: The updated name of the teacher creating the test. Required.
     """
-    _id = fields.Str(required=True)
+    _id = ObjectIdField(required=True)
     testName = fields.Str(required=True)
     courseCode = fields.Str(required=True)
     calculator = fields.Boolean(required=True)
-    testLength = fields.Number(required=True)
+    testLength = WholeNumber(required=True)
     notes = fields.Str(required=True)
-    students = fields.List(fields.Str, required=True)
-    date = fields.Date(required=True)
-    period = fields.Number(required=True)
+    students = fields.List(ObjectIdField, required=True)
+    date = DateString(required=True)
+    period = WholeNumber(required=True)
     startTime = fields.List(fields.Str, required=True)
     teacherName = fields.Str(required=True)
 
+    @validates_schema
+    def validate_start_times(self, data, **kwargs):
+        # the start times are matched to the students by position, so a partial update cannot change one without
+        # the other (PATCH /test/students changes the students and keeps the start times aligned)
+        if "students" in data and len(data.get("startTime", ())) != len(data["students"]):
+            raise ValidationError("startTime must have one start time for each student")
+
 
 class StudentCreationSchema(Schema):
     """Schema for validating the request body when creating a new student.
 
-    :param studentName: The name of the student. Required.
+    :param name: The name of the student. Required.
     :param email: The email address of the student. Required.
-    :param extraTime: The amount of extra time (min) the student is allowed for tests. Required, should be a number.
+    :param extraTime: The amount of extra time (min) the student is allowed for tests. Required, should be an integer.
     """
-    studentName = fields.Str(required=True)
+    name = fields.Str(required=True)
+    email = fields.Str(required=True)
+    extraTime = WholeNumber(required=True)
+
+
+class StudentUpdateRequestBodySchema(Schema):
+    """Schema for validating the request body when updating a student.
+
+    :param _id: The ID of the student to be updated. Required.
+    :param name: The updated name of the student. Required.
+    :param email: The updated email address of the student. Required.
+    :param extraTime: The updated amount of extra time (min) the student is allowed for tests. Required, should be an integer.
+    """
+    _id = ObjectIdField(required=True)
+    name = fields.Str(required=True)
     email = fields.Str(required=True)
-    extraTime = fields.Number(required=True)
+    extraTime = WholeNumber(required=True)
 
 
 class StudentExtraTimeRequestBodySchema(Schema):
     """Schema for validating the request body when updating a student's extra time for a test.
 
-    :param studentName: The name of the student for which extra time needs to be added to. Required.
-    :param extraTime: The updated extra time needed for the test. Required, should be a Number.
+    :param email: The email of the student for which extra time needs to be added to. Required.
+    :param studentName: The name of the student, as it appears in the accommodations spreadsheet. Optional.
+    :param extraTime: The updated extra time needed for the test. Required, should be an integer.
     """
-    studentName = fields.Str(required=True)
-    extraTime = fields.Number(required=True)
+    email = fields.Str(required=True)
+    studentName = fields.Str()
+    extraTime = WholeNumber(required=True)
 
 
 class StudentExtraTimeRequestBodySchemaArray(Schema):
@@ -150,18 +1094,74 @@ class TestUpdateTimeRequestBodySchema(Schema):
     :param _id: The ID of the test for which the start time is being updated. Required.
     :param startTime: The updated start time of the test. Required, should be a string in HH:MM format.
     """
-    _id = fields.Str(required=True)
+    _id = ObjectIdField(required=True)
     startTime = fields.List(fields.Str, required=True)
 
 
+class TestStudentStartTimeRequestBodySchema(Schema):
+    """Schema for validating the request body when updating the start time of one student of a test.
+
+    :param _id: The ID of the test. Required.
+    :param student: The ID of the student whose start time is being updated. Required.
+    :param startTime: The updated start time of the student. Required, should be a string in HH:MM format.
+    """
+    _id = ObjectIdField(required=True)
+    student = ObjectIdField(required=True)
+    startTime = fields.Str(required=True)
+
+
 class CourseCreationRequestBodySchema(Schema):
     """Schema for validating the request body when creating a new course.
 
     :param courseName: The name of the course. Required.
-    :param students: A list of student IDs enrolled in the course. Required, each ID should be a string.
+    :param students: A list of student IDs enrolled in the course. Required, each ID should be the string of an ObjectId.
+    """
+    courseName = fields.Str(required=True)
+    students = fields.List(ObjectIdField, required=True)
+
+
+class CourseUpdateRequestBodySchema(Schema):
+    """Schema for validating the request body when updating a course.
+
+    :param _id: The ID of the course to be updated. Required.
+    :param courseName: The updated name of the course. Required.
+    :param students: A list of student IDs enrolled in the course. Required, each ID should be the string of an ObjectId.
     """
+    _id = ObjectIdField(required=True)
     courseName = fields.Str(required=True)
-    students = fields.List(fields.Str, required=True)
+    students = fields.List(ObjectIdField, required=True)
+
+
+class IdRequestBodySchema(Schema):
+    """Schema for validating the request body when deleting a test, student or course, or a batch of them.
+
+    :param _id: The ID of the document to be deleted.
+    :param ids: The IDs of the documents to be deleted, at most MAX_BATCH_SIZE of them. Either _id or ids is required.
+    """
+    _id = ObjectIdField()
+    ids = fields.List(ObjectIdField, validate=validate.Length(min=1, max=MAX_BATCH_SIZE))
+
+    @validates_schema
+    def validate_one_of(self, data, **kwargs):
+        if ("_id" in data) == ("ids" in data):
+            raise ValidationError("Either _id or ids is required")
+
+
+class RosterUpdateRequestBodySchema(Schema):
+    """Schema for validating the request body when adding students to, or removing students from, a test or course.
+
+    :param _id: The ID of the test or course. Required.
+    :param add: The IDs of the students to add, at most MAX_BATCH_SIZE of them.
+    :param remove: The IDs of the students to remove, at most MAX_BATCH_SIZE of them. Either add or remove is required.
+    """
+    _id = ObjectIdField(required=True)
+    add = fields.List(ObjectIdField, validate=validate.Length(max=MAX_BATCH_SIZE))
+    remove = fields.List(ObjectIdField, validate=validate.Length(max=MAX_BATCH_SIZE))
+
+    @validates_schema
+    def validate_not_empty(self, data, **kwargs):
+        if not data.get("add") and not data.get("remove"):
+            raise ValidationError("Either add or remove is required")
 
 
 class initialUploadRequestBodySchema(Schema):
@@ -184,131 +1184,408 @@ class initialUploadRequestBodySchemaArray(Schema):
     arrayStudents = fields.List(fields.Nested(initialUploadRequestBodySchema), required=True)
 
 
+# The schemas used by the routes, created once: a schema holds no state between loads, so one instance is shared by
+# every request instead of building a new one (and its fields) each time
+test_creation_schema = TestCreationRequestBodySchema()
+test_update_schema = TestUpdateRequestBodySchema()
+test_update_time_schema = TestUpdateTimeRequestBodySchema()
+test_student_start_time_schema = TestStudentStartTimeRequestBodySchema()
+student_creation_schema = StudentCreationSchema()
+student_update_schema = StudentUpdateRequestBodySchema()
+student_extra_time_schema = StudentExtraTimeRequestBodySchemaArray()
+course_creation_schema = CourseCreationRequestBodySchema()
+course_update_schema = CourseUpdateRequestBodySchema()
+id_schema = IdRequestBodySchema()
+roster_update_schema = RosterUpdateRequestBodySchema()
+upload_row_schema = initialUploadRequestBodySchema()
+upload_schema = initialUploadRequestBodySchemaArray()
+
+
 ####################  Bulk uploading data  #######################
 
-@app.route("/upload", methods=['POST'])
-def upload():
-    """
-    Uploads student and course data to the 'students' and 'courses' collections in the 'testApp' database.
+# Request bodies in these formats are read, validated and written to the database in batches while they are
+# still being received, instead of being parsed as a whole
+STREAMING_UPLOAD_TYPES = ("application/x-ndjson", "application/ndjson", "text/csv")
+UPLOAD_BATCH_SIZE = int(environ.get("UPLOAD_BATCH_SIZE") or 1000)
 
-    Returns:
-    - 201 Created: If the data is successfully uploaded to the collections.
-    - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+
+class UploadRowError(Exception):
+    """Raised when a row of a streamed upload does not match the initialUploadRequestBodySchema.
+
+    :param row: The number of the row (starting at 1, not counting a CSV header).
+    :param messages: The validation error messages of the row.
+
+    Its uploaded attribute is the number of rows written before the invalid row and kept. It starts at 0, is set by
+    upload_batches, and is 0 again when the upload is swapped in (the written rows are dropped with it).
     """
 
-    # checks the schema to verify or validate that all the necessary fields are given in the json file
-    json_data = request.get_json()
+    def __init__(self, row, messages):
+        super().__init__(f"Invalid row {row}")
+        self.row = row
+        self.messages = messages
+        self.uploaded = 0
+
+
+def iter_upload_rows():
+    """Reads the request body one line at a time and yields each validated row.
+    NDJSON bodies have one JSON object per line; CSV bodies have a header row naming the columns.
+
+    :return: A generator of dictionaries with the studentName, email and courseName of each row.
+    :raise: UploadRowError if a row cannot be parsed or does not match the initialUploadRequestBodySchema.
+    """
+    body = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+
+    if request.mimetype == "text/csv":
+        lines = csv.DictReader(body)
+    else:
+        lines = (line for line in body if line.strip())  # skips blank lines, such as a trailing newline
+
+    lines = iter(lines)
+    for number in count(start=1):
+        try:
+            line = next(lines, None)  # read inside the try, as the body is decoded while the line is read
+            if line is None:
+                return
+            row = line if isinstance(line, dict) else json.loads(line)
+            data = upload_row_schema.load(row)
+        except ValidationError as err:
+            raise UploadRowError(number, err.messages)
+        except (ValueError, csv.Error):  # the line is not valid JSON, CSV or UTF-8
+            raise UploadRowError(number, "The row could not be parsed")
+        yield data
+
+
+def upload_batches(rows):
+    """Splits the upload rows into batches of UPLOAD_BATCH_SIZE rows.
+
+    :param rows: The validated upload rows, as a list or as the generator returned by iter_upload_rows.
+    :return: A generator of tuples of rows.
+    :raise: UploadRowError if a row is invalid. Its uploaded attribute is set to the number of rows in the batches
+            before it, which have already been written.
+    """
+    count = 0
     try:
-        result = initialUploadRequestBodySchemaArray().load(json_data)
-    except ValidationError as err:  # throws an error instead of causing the whole program to break
-        return '', 400  # bad request
+        for batch in batched(rows, UPLOAD_BATCH_SIZE):
+            yield batch
+            count += len(batch)
+    except UploadRowError as err:
+        err.uploaded = count
+        raise
+
+
+def write_roster(rows, students_collection, courses_collection):
+    """Writes the uploaded roster into empty collections, one batch at a time. Students are identified by email and
+    courses by name, so a student or course listed on several rows is only added once.
 
-    response = json_data["arrayStudents"]
+    Each student's _id is created here, before the student is inserted, so the students of every course are known
+    from the rows themselves (joined on email) and are written along with the course.
 
+    :param rows: The validated upload rows.
+    :param students_collection: The collection the students are written to.
+    :param courses_collection: The collection the courses are written to.
+    :return: The number of rows written.
+    """
+    count = 0
+    student_ids = {}  # the _id of every student written so far, by email
+    seen_courses = set()
+    for batch in upload_batches(rows):
+        # add all the new students from the batch into the database, giving each of them its _id
+        students = []
+        for data in batch:
+            if data["email"] not in student_ids:
+                student_ids[data["email"]] = ObjectId()
+                students.append({
+                    "_id": student_ids[data["email"]],
+                    "name": data["studentName"],
+                    "email": data["email"],
+                    "extraTime": 0
+                })
+
+        # the students of each course in this batch, in the order they are listed and without duplicates
+        course_students = {}
+        for data in batch:
+            course_students.setdefault(data["courseName"], {})[student_ids[data["email"]]] = None
+
+        # new courses are inserted with their students, and the courses from earlier batches get the new students
+        courses = []
+        course_operations = []
+        for course_name, ids in course_students.items():
+            if course_name in seen_courses:
+                course_operations.append(UpdateOne({"courseName": course_name},
+                                                   {"$addToSet": {"students": {"$each": list(ids)}}}))
+            else:
+                courses.append({
+                    "courseName": course_name,
+                    "students": list(ids),
+                })
+        seen_courses.update(course_students)
+
+        if students:
+            students_collection.insert_many(students)
+        if courses:
+            courses_collection.insert_many(courses)
+        if course_operations:
+            courses_collection.bulk_write(course_operations, ordered=False)
+        count += len(batch)
+    return count
+
+
+def replace_roster(rows):
+    """Clears the students, tests and courses collections, then writes the uploaded roster into them.
+    Until the writes finish, the routes reading these collections see an empty or partial roster.
+
+    :param rows: The validated upload rows.
+    :return: The body of the upload response.
+    """
     # completely clears the database
     collectionStudents.delete_many({})
     collectionTests.delete_many({})
     collectionCourses.delete_many({})
 
-    # using a set, add all the students from the given file and upload them into the database using a for loop
-    student_data = set(
-        (data["studentName"], data["email"]) for data in response)
+    return {"uploaded": write_roster(rows, collectionStudents, collectionCourses)}
 
-    students = [{
-        "name": data[0],
-        "email": data[1],
-        "extraTime": 0
-    } for data in student_data]
 
-    collectionStudents.insert_many(students)  # inserts all the students into the student collection
+def swap_roster(rows):
+    """Writes the uploaded roster into staging collections and builds their indexes, then swaps each of them in
+    place of the live students, tests and courses collections with renameCollection. The routes keep reading the
+    old roster until the swap, and the live collections are left untouched if anything fails before it.
 
-    # Does the same thing for uploading all the courses in the given file
-    course_data = set(data["courseName"] for data in response)
-    courses = [{
-        "courseName": data,
-        "students": [],
-    } for data in course_data]
+    Each rename is atomic on its own, but the three collections are swapped one after the other.
 
-    collectionCourses.insert_many(courses)
+    :param rows: The validated upload rows.
+    :return: The body of the upload response.
+    """
+    live_collections = (collectionStudents, collectionCourses, collectionTests)
+    staging = {collection: get_db()[collection.name + "_staging"] for collection in live_collections}
+    for staging_collection in staging.values():
+        staging_collection.drop()  # leftovers from an upload that failed
 
-    return "", 201  # Created
+    try:
+        count = write_roster(rows, staging[collectionStudents], staging[collectionCourses])
+        for collection, staging_collection in staging.items():
+            # this also creates the staging tests collection, as the new roster starts with no tests
+            staging_collection.create_indexes(INDEXES[collection])
+    except Exception as err:
+        for staging_collection in staging.values():
+            staging_collection.drop()
+        if isinstance(err, UploadRowError):
+            err.uploaded = 0  # the rows written before the invalid row were only in the dropped staging collections
+        raise
+
+    for collection, staging_collection in staging.items():
+        staging_collection.rename(collection.name, dropTarget=True)
+    return {"uploaded": count}
+
+
+def sync_roster(rows):
+    """Compares the uploaded roster with the existing students (by email) and courses (by name), and only writes
+    the differences: new students and courses are inserted, students whose name changed and courses whose students
+    changed are updated, and the students and courses missing from the upload are deleted. Tests and extra times
+    are kept.
+
+    The student inserts and updates are sent as one bulk write per batch. The course writes and the deletes are
+    only sent once every row has been read, so an invalid row never changes a course or causes a deletion.
+
+    :param rows: The validated upload rows.
+    :return: The body of the upload response, with the number of students and courses inserted, updated,
+             deleted and unchanged.
+    """
+    existing_students = {doc["email"]: doc for doc in collectionStudents.find({}, {"email": 1, "name": 1})}
+    existing_courses = {doc["courseName"]: doc.get("students", [])
+                        for doc in collectionCourses.find({}, {"_id": 0, "courseName": 1, "students": 1})}
+
+    student_changes = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    course_changes = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+    count = 0
+    student_ids = {}  # the _id of every uploaded student, by email
+    course_students = {}  # the uploaded students of every course, in the order they are listed
+    for batch in upload_batches(rows):
+        student_operations = []
+        for data in batch:
+            email = data["email"]
+            if email in student_ids:
+                continue
+            if email not in existing_students:
+                student_ids[email] = ObjectId()  # given here so the course can list the student before it exists
+                student_operations.append(UpdateOne({"email": email}, {"$setOnInsert": {
+                    "_id": student_ids[email], "name": data["studentName"], "extraTime": 0}}, upsert=True))
+                student_changes["inserted"] += 1
+            else:
+                student_ids[email] = existing_students[email]["_id"]
+                if existing_students[email].get("name") != data["studentName"]:
+                    student_operations.append(UpdateOne({"email": email}, {"$set": {"name": data["studentName"]}}))
+                    student_changes["updated"] += 1
+                else:
+                    student_changes["unchanged"] += 1
+
+        for data in batch:
+            course_students.setdefault(data["courseName"], {})[student_ids[data["email"]]] = None
+
+        if student_operations:
+            collectionStudents.bulk_write(student_operations, ordered=False)
+        count += len(batch)
+
+    course_operations = []
+    for course_name, ids in course_students.items():
+        if course_name not in existing_courses:
+            course_changes["inserted"] += 1
+        elif existing_courses[course_name] != list(ids):
+            course_changes["updated"] += 1
+        else:
+            course_changes["unchanged"] += 1
+            continue
+        course_operations.append(UpdateOne({"courseName": course_name},
+                                           {"$set": {"students": list(ids)}}, upsert=True))
+    if course_operations:
+        collectionCourses.bulk_write(course_operations, ordered=False)
+
+    removed_emails = [email for email in existing_students if email not in student_ids]
+    if removed_emails:
+        student_changes["deleted"] = collectionStudents.delete_many({"email": {"$in": removed_emails}}).deleted_count
+        remove_from_rosters([existing_students[email]["_id"] for email in removed_emails])  # kept tests drop them
+    removed_courses = [course_name for course_name in existing_courses if course_name not in course_students]
+    if removed_courses:
+        course_changes["deleted"] = collectionCourses.delete_many(
+            {"courseName": {"$in": removed_courses}}).deleted_count
+
+    return {"uploaded": count, "students": student_changes, "courses": course_changes}
+
+
+# the ways an upload can replace the existing roster, chosen with the mode query parameter
+UPLOAD_MODES = {
+    "replace": replace_roster,
+    "swap": swap_roster,
+    "sync": sync_roster,
+}
+
+
+@api.route("/upload", methods=['POST'])
+def upload():
+    """
+    Uploads student and course data to the 'students' and 'courses' collections in the 'testApp' database.
+
+    The request body is either a JSON with an arrayStudents list, or a file streamed as NDJSON
+    (Content-Type application/x-ndjson) or CSV (Content-Type text/csv) with one studentName, email and
+    courseName per row. Rows are written to the database in batches of UPLOAD_BATCH_SIZE.
+
+    Query Parameters:
+    - mode (str): "replace" (default) clears the collections before writing the new roster. For NDJSON and CSV,
+      whose rows are only validated as they are read, it works like "swap", so an invalid row leaves the old roster
+      in place.
+      "swap" writes the new roster into staging collections and swaps them in once they are complete, so the
+      old roster stays readable during the upload.
+      "sync" only writes the differences between the new roster and the existing one, and keeps the tests and
+      the students' extra times.
+
+    Returns:
+    - 201 Created: If the data is successfully uploaded to the collections, with the number of rows uploaded
+      (and, for "sync", a summary of the changes).
+    - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+    """
+    mode = request.args.get("mode") or "replace"
+    if mode not in UPLOAD_MODES:
+        return json.dumps({"error": f"Unknown upload mode '{mode}'"}), 400  # bad request
+
+    if request.mimetype in STREAMING_UPLOAD_TYPES:
+        rows = iter_upload_rows()
+        if mode == "replace":
+            # streamed rows are only validated as they are written, so the live roster must not be cleared before
+            # the last one is read: the new roster is written into staging collections and swapped in instead
+            mode = "swap"
+    else:
+        # checks the schema to verify or validate that all the necessary fields are given in the json file
+        try:
+            rows = upload_schema.load(request.get_json())["arrayStudents"]
+        except ValidationError as err:  # throws an error instead of causing the whole program to break
+            return '', 400  # bad request
+
+    try:
+        summary = UPLOAD_MODES[mode](rows)
+    except UploadRowError as err:
+        return {"error": str(err), "row": err.row, "messages": err.messages, "uploaded": err.uploaded}, 400
+    finally:  # the rows before an invalid row may already have been written
+        bump_version(collectionStudents, collectionCourses, collectionTests)
+
+    return summary, 201  # Created
 
 
 ####################  Managing the test database  #######################
 
-@app.route("/test", methods=['POST'])
-def add_test():
-    """Adds a new test to the 'tests' collection in the 'testApp' database.
+def new_test(data):
+    """Builds the document of a new test, with an empty start time for each of its students.
 
-    This route expects a JSON with the following fields according to the TestCreation Schema
+    :param data: The loaded request body of the test.
+    :return: The document to insert.
+    """
+    return {
+        "testName": data["testName"],
+        "courseCode": data["courseCode"],
+        "calculator": data["calculator"],
+        "testLength": data["testLength"],
+        "notes": data["notes"],
+        "students": data["students"],
+        "date": data["date"],
+        "period": data["period"],
+        "startTime": [""] * len(data["students"]),
+        "teacherName": data["teacherName"]
+    }
+
+
+@api.route("/test", methods=['POST'])
+@validated(test_creation_schema, allow_many=True)
+def add_test(data):
+    """Adds a new test, or a batch of tests, to the 'tests' collection in the 'testApp' database.
+
+    This route expects a JSON with the following fields according to the TestCreation Schema, or a JSON array of them
     - testName (str): The name of the test.
     - courseCode (str): The course code for which the test is being created.
     - calculator (bool): Whether a calculator is allowed for the test.
     - testLength (int): The length of the test in minutes.
     - notes (str): Any additional notes or instructions for the test.
     - students (list of str): A list of student IDs for whom the test is intended.
-    - date (str): The date of the test in date format.
+    - date (str): The date of the test in YYYY-MM-DD format.
     - period (int): The period or session for the test.
     - teacherName (str): The name of the teacher creating the test.
 
     Returns:
-    - 201 Created: If the test is successfully added to the collection.
+    - 201 Created: If the test is successfully added to the collection. For an array, with the IDs of the new tests
+      (see insert_batch).
+    - 207 Multi-Status: If only some of the tests of an array are added, with the errors of the others.
     - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
     """
+    if isinstance(data, Batch):  # every valid test is added in a single write
+        return insert_batch(collectionTests, data, new_test)
 
-    # checks the schema to verify or validate that all the necessary fields are given in the json file
-    json_data = request.get_json()
-    try:
-        result = TestCreationRequestBodySchema().load(json_data)
-    except ValidationError as err:  # throws an error instead of causing the whole program to break
-        return '', 400  # bad request
-
-    response = request.get_json()
-    student = response["students"]
-    listOfStudents = []
-    for x in student:
-        listOfStudents.append(
-            ObjectId(x))  # Add the student IDs as strings into a list after turning them into ObjectIDs
-
-    # adding the new test into the collection
-    collectionTests.insert_one({
-        "testName": response["testName"],
-        "courseCode": response["courseCode"],
-        "calculator": response["calculator"],
-        "testLength": response["testLength"],
-        "notes": response["notes"],
-        "students": student,
-        "date": response["date"],
-        "period": response["period"],
-        "startTime": [""] * len(response["students"]),
-        "teacherName": response["teacherName"]
-    })
+    # adding the new test into the collection, with the student IDs as ObjectIds and the date as a string
+    collectionTests.insert_one(new_test(data))
 
+    bump_version(collectionTests)
     return '', 201  # created
 
 
-@app.route("/test", methods=['DELETE'])
-def delete_test():
-    """Deletes a test from the 'tests' collection in the 'testApp' database by finding its ObjectID
+@api.route("/test", methods=['DELETE'])
+@validated(id_schema)
+def delete_test(data):
+    """Deletes a test, or a batch of tests, from the 'tests' collection in the 'testApp' database by finding their
+    ObjectIDs
 
-    This route expects a JSON with the following field:
+    This route expects a JSON with one of the following fields:
     - _id (str): The ID of the test to be deleted.
+    - ids (list of str): The IDs of the tests to be deleted.
 
     Returns:
-    - 200 OK: If the test is successfully deleted from the collection.
+    - 200 OK: If the tests are successfully deleted from the collection. For ids, with the number of tests deleted.
+    - 400 Bad Request: If the _id or ids are missing or invalid.
     """
-    response = request.get_json()
-    id = response["_id"]
-
-    # finds the data with the given object ID and deletes it
-    collectionTests.delete_one({
-        "_id": ObjectId(id)
-    })
-    return '', 200  # OK
+    # finds the data with the given object IDs and deletes it, in a single write
+    result = collectionTests.delete_many({"_id": {"$in": get_ids(data)}})
+    bump_version(collectionTests)
+    return delete_response(data, result.deleted_count)
 
 
-@app.route("/test", methods=['PATCH'])
-def update_test():
+@api.route("/test", methods=['PATCH'])
+@validated(test_update_schema, allow_partial=True)
+def update_test(data):
     """
     Updates an existing test in the 'tests' collection of the 'testApp' database.
 
@@ -320,54 +1597,36 @@ def update_test():
     - testLength (int): The updated length of the test in minutes.
     - notes (str): Any additional notes or instructions for the test.
     - students (list of str): A list of updated student IDs for whom the test is intended.
-    - date (str): The updated date of the test in date format.
+    - date (str): The updated date of the test in YYYY-MM-DD format.
     - period (int): The updated period or session for the test.
-    - startTime (str): The updated start time of the test in HH:MM format.
+    - startTime (list of str): The updated start times of the students, in the same order as students. It must be
+      given with students, even with partial=true, and have as many items.
     - teacherName (str): The updated name of the teacher creating the test.
 
+    Query Parameters:
+    - partial (str): If "true", only the _id and the fields that changed need to be given.
+
     Returns:
     - 200 OK: If the test is successfully updated in the collection.
     - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+    - 404 Not Found: If no test has the given ID.
     """
-    # checks the schema to verify or validate that all the necessary fields are given in the json file
-    response = request.get_json()
-    try:
-        result = TestUpdateRequestBodySchema().load(response)
-    except ValidationError as err:
-        return '', 400  # bad request
-
-    # expects all fields of a test to be given, even if it remains unchanged.
-    id = response["_id"]
-    student = response["students"]
-    listOfStudents = []
-    for x in student:
-        listOfStudents.append(ObjectId(x))  # Convert student string ids into ObjectIDs
-
-    collectionTests.update_one({"_id": ObjectId(id)},  # finds the test with the given ObjectID
-                               {"$set": {"testName": response["testName"]}})  # changes a certain field
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"courseCode": response["courseCode"]}})
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"calculator": response["calculator"]}})
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"testLength": response["testLength"]}})
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"notes": response["notes"]}})
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"students": student}})
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"date": response["date"]}})
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"period": response["period"]}})
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"startTime": response["startTime"]}})
-    collectionTests.update_one({"_id": ObjectId(id)},
-                               {"$set": {"teacherName": response["teacherName"]}})
+    test_id = data.pop("_id")
+    if not data:
+        return '', 400  # bad request, nothing to update
+
+    # all the changed fields are written in a single atomic update, so readers never see a half-updated test
+    result = collectionTests.update_one({"_id": test_id},  # finds the test with the given ObjectID
+                                        {"$set": data})
+    if result.matched_count == 0:
+        return '', 404  # Not found
+    bump_version(collectionTests)
     return '', 200  # OK
 
 
-@app.route("/test/start", methods=['PATCH'])
-def update_testStartTime():
+@api.route("/test/start", methods=['PATCH'])
+@validated(test_update_time_schema)
+def update_testStartTime(data):
     """Updates the start time of an existing test in the 'tests' collection in the 'testApp' database.
 
     This route expects a JSON payload with the following fields:
@@ -378,38 +1637,96 @@ def update_testStartTime():
     - 200 OK: If the start time of the test is successfully updated in the collection.
     - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
     """
-    # checks the schema to verify or validate that all the necessary fields are given in the json file
-    response = request.get_json()
-    try:
-        result = TestUpdateTimeRequestBodySchema().load(response)
-    except ValidationError as err:
-        return '', 400  # Bad request
+    collectionTests.update_one({"_id": data["_id"]},  # finds test with given ObjectID
+                               {"$set": {"startTime": data["startTime"]}})  # updates start time only
+    bump_version(collectionTests)
+    return '', 200  # OK
 
-    id = response["_id"]
 
-    collectionTests.update_one({"_id": ObjectId(id)},  # finds test with given ObjectID
-                               {"$set": {"startTime": response["startTime"]}})  # updates start time only
-    return '', 200  # OK
+@api.route("/test/students", methods=['PATCH'])
+@validated(roster_update_schema)
+def update_test_students(data):
+    """Adds students to, and removes students from, an existing test in the 'tests' collection in the 'testApp'
+    database, without sending its whole list of students and start times.
+
+    This route expects a JSON payload with the following fields:
+    - _id (str): The ID of the test.
+    - add (list of str): The IDs of the students to add, each with an empty start time. Students already on the
+      test are skipped.
+    - remove (list of str): The IDs of the students to remove, along with their start times.
+
+    Returns:
+    - 200 OK: If the students of the test are successfully updated.
+    - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+    - 404 Not Found: If no test has the given ID.
+    - 409 Conflict: If the students of the test kept changing while they were being updated.
+    """
+    status = write_test_roster(data["_id"], lambda test: get_test_roster_write(test, data.get("remove", []),
+                                                                               data.get("add", [])))
+    return '', status or 200  # OK if there was nothing to change
+
+
+@api.route("/test/students/start", methods=['PATCH'])
+@validated(test_student_start_time_schema)
+def update_test_student_start_time(data):
+    """Updates the start time of one student of an existing test in the 'tests' collection in the 'testApp'
+    database, without sending the start times of the other students.
 
+    This route expects a JSON payload with the following fields:
+    - _id (str): The ID of the test.
+    - student (str): The ID of the student whose start time is being updated.
+    - startTime (str): The updated start time of the student in HH:MM format.
 
-@app.route("/test", methods=['GET'])
+    Returns:
+    - 200 OK: If the start time of the student is successfully updated.
+    - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+    - 404 Not Found: If no test has the given ID, or the student is not on it.
+    - 409 Conflict: If the students of the test kept changing while the start time was being updated.
+    """
+    status = write_test_roster(data["_id"], lambda test: get_test_start_time_write(test, data["student"],
+                                                                                   data["startTime"]))
+    return '', status or 404  # Not found if the student is not on the test
+
+
+@api.route("/test", methods=['GET'])
 def get_test():
     """Retrieves test data from the 'tests' collection in the 'testApp' database based on query parameters.
 
     Query Parameters:
     - testName (str): The name of the test to retrieve.
     - courseCode (str): The course code for which the test was created.
-    - date (str): The date of the test in date format.
+    - date (str): The date of the test in YYYY-MM-DD format.
     - period (int): The period or session for the test.
+    - limit (int): The number of documents per page. Turns on pagination.
+    - next (str): The token of the next page, given in the previous page. Turns on pagination.
+    - stream (str): If "true" (and without pagination), the JSON array is streamed as it is read.
+    - fields (str): A comma-separated list of the fields to return.
+    - view (str): "summary" returns the tests without their list of students.
 
     Returns:
     - 200 json_data, OK: A JSON array containing the test data that matches the query parameters.
+      With pagination, a JSON object with the page of data in "data" and the token of the next page in "next".
+    - 400 Bad Request: If the date, the period, the limit, the next token or the requested fields are invalid.
+    """
+    try:
+        query_filter = get_test_filter(request.args)
+    except ValueError as err:
+        return json.dumps({"error": str(err)}), 400  # bad request
+    return find_documents(collectionTests, query_filter)
+
+
+def get_test_filter(args):
+    """Builds the filter of get_test from its query parameters, converted to the types the tests are stored with.
+
+    :param args: The query parameters of the request.
+    :return: The filter.
+    :raise: ValueError if the date or the period is invalid.
     """
     # gets all the given query parameters
-    testName = request.args.get('testName')
-    courseCode = request.args.get('courseCode')
-    date = request.args.get('date')
-    period = request.args.get('period')
+    testName = args.get('testName')
+    courseCode = args.get('courseCode')
+    date = args.get('date')
+    period = args.get('period')
 
     # filters through the database, obtaining only the data that matches the query parameters
     query_filter = {}
@@ -418,80 +1735,241 @@ def get_test():
     if courseCode is not None:
         query_filter["courseCode"] = courseCode
     if period is not None:
-        query_filter["period"] = period
+        query_filter["period"] = parse_int(period, "period")
     if date is not None:
-        query_filter["date"] = date
+        try:
+            query_filter["date"] = datetime.strptime(date, "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            raise ValueError("Invalid date")
+    return query_filter
 
-    cursor = collectionTests.find(query_filter)
 
-    # add all the found tests that matches the query parameters into a list
-    data = []
-    for doc in cursor:
-        data.append(doc)
-
-    # remove the $oid from each _id to simplify the process for the frontend
-    json_data = []
-    for doc in data:
-        json_data.append(flatten_oid(doc))
+####################  Managing the student database  #######################
 
-    return json_data, 200  # OK
+def new_student(data):
+    """Builds the document of a new student.
 
+    :param data: The loaded request body of the student.
+    :return: The document to insert.
+    """
+    return {
+        "name": data["name"],
+        "email": data["email"],
+        "extraTime": data["extraTime"],
+    }
 
-####################  Managing the student database  #######################
 
-@app.route("/students", methods=['POST'])
-def add_student():
-    """Adds a new student to the 'students' collection in the 'testApp' database.
+@api.route("/students", methods=['POST'])
+@validated(student_creation_schema, allow_many=True)
+def add_student(data):
+    """Adds a new student, or a batch of students, to the 'students' collection in the 'testApp' database.
 
-    This route expects a JSON payload with the following fields:
+    This route expects a JSON payload with the following fields, or a JSON array of them:
     - name (str): The name of the student.
     - email (str): The email address of the student.
     - extraTime (int): The amount of extra time (in minutes) the student is allowed for tests.
 
     Returns:
-    - 201 Created: If the student is successfully added to the collection.
+    - 201 Created: If the student is successfully added to the collection. For an array, with the IDs of the new
+      students (see insert_batch).
+    - 207 Multi-Status: If only some of the students of an array are added, with the errors of the others.
     - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+    - 409 Conflict: If a student with the same email already exists.
     """
-    # checks the schema to verify or validate that all the necessary fields are given in the json file
-    json_data = request.get_json()
+    if isinstance(data, Batch):  # every valid student is added in a single write
+        return insert_batch(collectionStudents, data, new_student,
+                            duplicate_error=("email", "A student with this email already exists"))
+
     try:
-        result = StudentCreationSchema().load(json_data)
-    except ValidationError as err:
-        return '', 400  # bad request
+        collectionStudents.insert_one(new_student(data))  # adds the new student into the student collection
+    except DuplicateKeyError:  # emails are unique in the student collection
+        return json.dumps({"error": "A student with this email already exists"}), 409  # Conflict
+    bump_version(collectionStudents)
+    return '', 201  # Created
 
-    response = request.get_json()
 
-    collectionStudents.insert_one({  # adds the new student into the student collection
-        "name": response["name"],
-        "email": response["email"],
-        "extraTime": response["extraTime"],
+def get_id_forms(student_ids):
+    """Gives the ways the IDs of students can be stored in a roster: older rosters hold them as strings.
 
-    })
-    return '', 201  # Created
+    :param student_ids: The ObjectIds of the students.
+    :return: The ObjectIds followed by their strings.
+    """
+    return student_ids + [str(student_id) for student_id in student_ids]
 
 
-@app.route("/students", methods=['DELETE'])
-def delete_student():
-    """Deletes a student from the 'students' collection in the 'testApp' database.
+def get_course_roster_update(data):
+    """Builds the writes adding students to, and removing students from, one course. Only the students that change
+    are sent, so the size of the writes does not depend on the size of the course. The students are removed first,
+    so a student in both lists stays in the course.
 
-    This route expects a JSON payload with the following field:
+    :param data: The loaded request body, validated by the RosterUpdateRequestBodySchema.
+    :return: The list of updates of the course ($pull, then $addToSet).
+    """
+    add = list(dict.fromkeys(data.get("add", [])))
+    remove = data.get("remove", [])
+    # the strings of the added students are pulled too, so that they are stored once, as ObjectIds
+    course_updates = [{"$pull": {"students": {"$in": get_id_forms(remove) + [str(student_id) for student_id in add]}}}]
+    if add:
+        course_updates.append({"$addToSet": {"students": {"$each": add}}})
+    return course_updates
+
+
+# The number of times a change to the students of a test is tried, when the students change between the read and
+# the write (see get_test_roster_write)
+ROSTER_WRITE_ATTEMPTS = 5
+
+
+def get_test_roster_write(test, remove, add=()):
+    """Builds the write removing students from, and adding students to, a test. Each removed student's start time
+    is removed with it, so that startTime stays aligned with students (a $pull of the students would shift them
+    against their start times). Added students already on the test are skipped, like $addToSet, and the others are
+    added at the end with an empty start time. The students are removed first, so a student in both lists stays on
+    the test. A startTime shorter than students is padded with empty start times.
+
+    When students are only added, just the new ones are sent, with $push, and the write only matches the test while
+    none of them is on it and both arrays still have the length read, which keeps them aligned. Otherwise both
+    arrays are rewritten from the positions read, and the write only matches the test while its students and start
+    times are both still the ones read, so that a start time set in between (by PATCH /test/start or
+    /test/students/start) is not overwritten with the value read. Either way, a write that matches nothing means the
+    test changed, and has to be read again.
+
+    :param test: The test, with its _id, students and startTime.
+    :param remove: The ObjectIds of the students to remove.
+    :param add: The ObjectIds of the students to add.
+    :return: The filter and the update, or None if the students of the test do not change.
+    """
+    students = test.get("students") or []
+    start_times = test.get("startTime") or []
+    removed = set(get_id_forms(list(remove)))
+    kept = [position for position, student in enumerate(students) if student not in removed]
+    on_test = {str(students[position]) for position in kept}  # older rosters hold the IDs as strings
+    added = [student_id for student_id in dict.fromkeys(add) if str(student_id) not in on_test]
+    if len(kept) == len(students) and not added:
+        return None
+
+    if len(kept) == len(students) and len(start_times) == len(students):
+        return ({"_id": test["_id"], "students": {"$size": len(students), "$nin": get_id_forms(added)},
+                 "startTime": {"$size": len(students)}},
+                {"$push": {"students": {"$each": added}, "startTime": {"$each": [""] * len(added)}}})
+    return {"_id": test["_id"], "students": students, "startTime": test.get("startTime")}, {"$set": {
+        "students": [students[position] for position in kept] + added,
+        "startTime": [start_times[position] if position < len(start_times) else "" for position in kept]
+                     + [""] * len(added),
+    }}
+
+
+def get_test_start_time_write(test, student_id, start_time):
+    """Builds the write setting the start time of one student of a test, at the position of the student in students
+    as it was read, which is also their position in startTime. The write only matches the test while the student is
+    still at that position. A startTime shorter than students is padded with empty start times.
+
+    :param test: The test, with its _id, students and startTime.
+    :param student_id: The ObjectId of the student.
+    :param start_time: The start time of the student.
+    :return: The filter and the update, or None if the student is not on the test.
+    """
+    students = test.get("students") or []
+    start_times = test.get("startTime") or []
+    forms = get_id_forms([student_id])
+    position = next((position for position, student in enumerate(students) if student in forms), None)
+    if position is None:
+        return None
+
+    test_filter = {"_id": test["_id"], f"students.{position}": students[position]}
+    if position < len(start_times):
+        return test_filter, {"$set": {f"startTime.{position}": start_time}}
+    start_times = start_times + [""] * (len(students) - len(start_times))
+    start_times[position] = start_time
+    return dict(test_filter, startTime=test.get("startTime")), {"$set": {"startTime": start_times}}
+
+
+def write_test_roster(test_id, build):
+    """Reads the students and start times of a test and sends the write that build makes from them, reading the
+    test again if it changed before the write (see get_test_roster_write).
+
+    :param test_id: The ObjectId of the test.
+    :param build: The function building the filter and the update from the test, or None if there is nothing to
+                  write.
+    :return: 200 if the test was written, None if there was nothing to write, 404 if there is no such test, or 409
+             if the test kept changing for ROSTER_WRITE_ATTEMPTS attempts.
+    """
+    for _ in range(ROSTER_WRITE_ATTEMPTS):
+        test = collectionTests.find_one({"_id": test_id}, {"students": 1, "startTime": 1})
+        if test is None:
+            return 404  # Not found
+        write = build(test)
+        if write is None:
+            return None
+        if collectionTests.update_one(*write).matched_count:
+            bump_version(collectionTests)
+            return 200  # OK
+    return 409  # Conflict
+
+
+def get_roster_cleanup(student_ids):
+    """Builds the filter and the course update removing deleted students from every test and course. Courses $pull
+    the students in a single update_many, and each test is rewritten by get_test_roster_write.
+
+    :param student_ids: The ObjectIds of the deleted students.
+    :return: The filter matching the rosters holding any of the students, and the update of the courses.
+    """
+    roster_filter = {"students": {"$in": get_id_forms(student_ids)}}
+    course_update = {"$pull": {"students": {"$in": get_id_forms(student_ids)}}}
+    return roster_filter, course_update
+
+
+def remove_from_rosters(student_ids):
+    """Removes deleted students from the students (and start times) of every test and course. The tests holding
+    them are read and rewritten in unordered bulk writes of up to MAX_BATCH_SIZE tests (see get_test_roster_write).
+
+    Each write is guarded on both the students and the start times of the test as they were read, so a test
+    changed in the meantime is left alone rather than overwritten: a start time a proctor sets while a class is
+    being deleted is not lost. Such tests are read and rewritten again, up to ROSTER_WRITE_ATTEMPTS times.
+
+    :param student_ids: The ObjectIds of the deleted students.
+    """
+    roster_filter, course_update = get_roster_cleanup(student_ids)
+    collectionCourses.update_many(roster_filter, course_update)
+
+    for _ in range(ROSTER_WRITE_ATTEMPTS):
+        missed = 0
+        tests = collectionTests.find(roster_filter, {"students": 1, "startTime": 1})
+        for batch in batched(tests, MAX_BATCH_SIZE):
+            writes = [write for write in (get_test_roster_write(test, student_ids) for test in batch) if write]
+            if writes:
+                missed += len(writes) - collectionTests.bulk_write(
+                    [UpdateOne(*write) for write in writes], ordered=False).matched_count
+        if not missed:
+            return
+    logger.warning("Some tests still list deleted students after %d attempts", ROSTER_WRITE_ATTEMPTS)
+
+
+@api.route("/students", methods=['DELETE'])
+@validated(id_schema)
+def delete_student(data):
+    """Deletes a student, or a batch of students, from the 'students' collection in the 'testApp' database, and
+    removes them from the students of every test and course.
+
+    This route expects a JSON payload with one of the following fields:
     - _id (str): The ID of the student to be deleted.
+    - ids (list of str): The IDs of the students to be deleted.
 
     Returns:
-    - 200 OK: If the student is successfully deleted from the collection.
+    - 200 OK: If the students are successfully deleted from the collection. For ids, with the number of students
+      deleted.
+    - 400 Bad Request: If the _id or ids are missing or invalid.
     """
-    response = request.get_json()
-    id = response["_id"]
-
-    collectionStudents.delete_one({
-        "_id": ObjectId(id)  # finds and deletes the student given their ObjectID
-    })
+    student_ids = get_ids(data)
+    result = collectionStudents.delete_many({"_id": {"$in": student_ids}})  # finds and deletes the students
+    remove_from_rosters(student_ids)
 
-    return '', 200  # OK
+    bump_version(collectionStudents, collectionTests, collectionCourses)
+    return delete_response(data, result.deleted_count)
 
 
-@app.route("/students", methods=['PATCH'])
-def update_student():
+@api.route("/students", methods=['PATCH'])
+@validated(student_update_schema, allow_partial=True)
+def update_student(data):
     """Updates an existing student in the 'users' collection in the 'testApp' database.
 
     This route expects a JSON payload with the following fields:
@@ -500,55 +1978,92 @@ def update_student():
     - email (str): The updated email address of the student.
     - extraTime (int): The updated amount of extra time (in minutes) the student is allowed for tests.
 
+    Query Parameters:
+    - partial (str): If "true", only the _id and the fields that changed need to be given.
+
     Returns:
     - 200 OK: If the student is successfully updated in the collection.
     - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+    - 404 Not Found: If no student has the given ID.
+    - 409 Conflict: If another student already has the given email.
     """
-    # checks the schema to verify or validate that all the necessary fields are given in the json file
-    response = request.get_json()
+    student_id = data.pop("_id")
+    if not data:
+        return '', 400  # Bad request, nothing to update
+
     try:
-        result = StudentCreationSchema().load(response)
-    except ValidationError as err:
-        return '', 400  # Bad request
-
-    id = response["_id"]
-    collectionStudents.update_one({"_id": ObjectId(id)},  # finds the student using ID
-                                  {"$set": {"name": response["name"]}})  # changes the fields
-    collectionStudents.update_one({"_id": ObjectId(id)},
-                                  {"$set": {"email": response["email"]}})
-    collectionStudents.update_one({"_id": ObjectId(id)},
-                                  {"$set": {"extraTime": response["extraTime"]}})
+        result = collectionStudents.update_one({"_id": student_id},  # finds the student using ID
+                                               {"$set": data})  # changes the fields
+    except DuplicateKeyError:  # emails are unique in the student collection
+        return json.dumps({"error": "A student with this email already exists"}), 409  # Conflict
+    if result.matched_count == 0:
+        return '', 404  # Not found
+    bump_version(collectionStudents)
     return '', 200  # OK
 
 
-@app.route("/students/extraTime", methods=['PATCH'])
-def update_student_extraTime():
-    """Updates a student's accommodation for a test (extra time)
+def get_extra_time_writes(rows, current):
+    """Works out the matched and modified counts of every row of an extra time update (bulk_write only reports
+    totals), and builds one update per student with its final extra time, so that a student given in several rows is
+    written once.
+
+    :param rows: The rows of the update, each with an email and an extraTime.
+    :param current: The current extra time of every student found, by email. It is updated along the rows.
+    :return: The counts of every row, and the list of UpdateOne operations.
+    """
+    row_counts = []
+    for row in rows:
+        matched = row["email"] in current
+        modified = matched and current[row["email"]] != row["extraTime"]
+        if matched:
+            current[row["email"]] = row["extraTime"]  # a later row for the same student sees this value
+        row_counts.append({"email": row["email"], "matched": int(matched), "modified": int(modified)})
+
+    final_extra_time = {row["email"]: row["extraTime"] for row in rows}
+    operations = [UpdateOne({"email": email}, {"$set": {"extraTime": extra_time}})
+                  for email, extra_time in final_extra_time.items()]
+    return row_counts, operations
+
 
-    This route expects a list of JSONs with the following fields:
-    - studentName: The name of the student whose extra time needs to be updated.
-    - extraTime: the amount of extra time the student needs (As a Number)
+@api.route("/students/extraTime", methods=['PATCH'])
+@validated(student_extra_time_schema)
+def update_student_extraTime(data):
+    """Updates the accommodation (extra time) of many students at once, in a single bulk write.
+
+    This route expects a JSON payload with the following field:
+    - arrayStudents (list): A list of JSONs with the following fields:
+        - email (str): The email of the student whose extra time needs to be updated.
+        - studentName (str, optional): The name of the student.
+        - extraTime: the amount of extra time the student needs (As a Number)
 
     Returns:
-    - 200 OK: If the course is successfully updated in the collection.
+    - 200 OK: A JSON with the total matched and modified counts, and the matched and modified counts of every row.
     - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
     """
-    # checks the schema to verify or validate that an array of students is given
-    response = request.get_json()
-    try:
-        result = StudentExtraTimeRequestBodySchemaArray().load(response)
-    except ValidationError as err:
-        return '', 400  # bad request
+    rows = data["arrayStudents"]
+    emails = list(set(row["email"] for row in rows))
 
-    # loops through all the jsons of students who need to have extra time
-    for x in response:
-        collectionStudents.updateOne({"name": x["name"]},
-                                     {"$set": {"extraTime": x["name"]}})
+    # bulk_write only reports totals, so the current extra times are read first (one query using the email index)
+    # to work out which rows match a student and which actually change it
+    current = {}
+    for doc in collectionStudents.find({"email": {"$in": emails}}, {"_id": 0, "email": 1, "extraTime": 1}):
+        current[doc["email"]] = doc.get("extraTime")
 
-    return '', 200  # OK
+    # one update per student with its final extra time, all sent in a single unordered bulk write
+    row_counts, operations = get_extra_time_writes(rows, current)
+
+    matched_count = 0
+    modified_count = 0
+    if operations:
+        bulk_result = collectionStudents.bulk_write(operations, ordered=False)
+        matched_count = bulk_result.matched_count
+        modified_count = bulk_result.modified_count
 
+    bump_version(collectionStudents)
+    return {"matched": matched_count, "modified": modified_count, "rows": row_counts}, 200  # OK
 
-@app.route("/students", methods=['GET'])
+
+@api.route("/students", methods=['GET'])
 def get_student():
     """Retrieves student data from the 'students' collection in the 'testApp' database based on query parameters.
 
@@ -556,15 +2071,35 @@ def get_student():
     - name (str): The name of the student to retrieve.
     - email (str): The email address of the student to retrieve.
     - extraTime (int): The amount of extra time (in minutes) the student is allowed for tests.
+    - limit (int): The number of documents per page. Turns on pagination.
+    - next (str): The token of the next page, given in the previous page. Turns on pagination.
+    - stream (str): If "true" (and without pagination), the JSON array is streamed as it is read.
+    - fields (str): A comma-separated list of the fields to return.
 
     Returns:
     - 200 OK: A JSON array containing the student data that matches the query parameters.
+      With pagination, a JSON object with the page of data in "data" and the token of the next page in "next".
+    - 400 Bad Request: If the extraTime, the limit, the next token, the _id or the requested fields are invalid.
+    """
+    try:
+        query_filter = get_student_filter(request.args)
+    except ValueError as err:
+        return json.dumps({"error": str(err)}), 400  # bad request
+    return find_documents(collectionStudents, query_filter)
+
+
+def get_student_filter(args):
+    """Builds the filter of get_student from its query parameters.
+
+    :param args: The query parameters of the request.
+    :return: The filter.
+    :raise: ValueError if the extraTime or the _id is invalid.
     """
     # gets all the given query parameters
-    name = request.args.get('name')
-    email = request.args.get('email')
-    extraTime = request.args.get('extraTime')
-    id = request.args.get('_id')
+    name = args.get('name')
+    email = args.get('email')
+    extraTime = args.get('extraTime')
+    id = args.get('_id')
 
     # filters through the database, obtaining only the information that matches the query parameters
     query_filter = {}
@@ -573,83 +2108,74 @@ def get_student():
     if email is not None:
         query_filter["email"] = email
     if extraTime is not None:
-        query_filter["extraTime"] = extraTime
+        query_filter["extraTime"] = parse_int(extraTime, "extraTime")
     if id is not None:
-        query_filter["_id"] = id
+        query_filter["_id"] = parse_object_id(id)
+    return query_filter
 
-    cursor = collectionStudents.find(query_filter)
 
-    # add all the found students that matches the query parameters into a list
-    data = []
-    for doc in cursor:
-        data.append(doc)
+####################  Managing the course database  #######################
 
-    # removes the $oid from each _id to simplify the processes in the frontend
-    json_data = []
-    for doc in data:
-        json_data.append(flatten_oid(doc))
+def new_course(data):
+    """Builds the document of a new course.
 
-    return json_data, 200  # OK
+    :param data: The loaded request body of the course.
+    :return: The document to insert.
+    """
+    return {
+        "courseName": data["courseName"],
+        "students": data["students"]
+    }
 
 
-####################  Managing the course database  #######################
-
-@app.route("/course", methods=['POST'])
-def add_course():
+@api.route("/course", methods=['POST'])
+@validated(course_creation_schema, allow_many=True)
+def add_course(data):
     """
-    Adds a new course to the 'courses' collection in the 'testApp' database.
+    Adds a new course, or a batch of courses, to the 'courses' collection in the 'testApp' database.
 
-    This route expects a JSON payload with the following fields:
+    This route expects a JSON payload with the following fields, or a JSON array of them:
     - courseName (str): The name of the course.
     - students (list of str): A list of student IDs enrolled in the course.
 
     Returns:
-    - 201 Created: If the course is successfully added to the collection.
+    - 201 Created: If the course is successfully added to the collection. For an array, with the IDs of the new
+      courses (see insert_batch).
+    - 207 Multi-Status: If only some of the courses of an array are added, with the errors of the others.
     - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
     """
-    # checks the schema to verify or validate that all the necessary fields are given in the json file
-    json_data = request.get_json()
-    try:
-        result = CourseCreationRequestBodySchema().load(json_data)
-    except ValidationError as err:
-        return '', 400  # bad request
-    response = request.get_json()
-
-    student = response["students"]
-    listOfStudents = []
-    for x in student:
-        listOfStudents.append(ObjectId(x))  # turn the strings of student ids into ObjectIDs and stores them into a list
+    if isinstance(data, Batch):  # every valid course is added in a single write
+        return insert_batch(collectionCourses, data, new_course)
 
-    collectionCourses.insert_one({  # adding the new course into the collection
-        "courseName": response["courseName"],
-        "students": listOfStudents
-    })
+    collectionCourses.insert_one(new_course(data))  # adding the new course into the collection
 
+    bump_version(collectionCourses)
     return '', 201  # Created
 
 
-@app.route("/course", methods=['DELETE'])
-def delete_course():
-    """Deletes a course from the 'courses' collection in the 'testApp' database.
+@api.route("/course", methods=['DELETE'])
+@validated(id_schema)
+def delete_course(data):
+    """Deletes a course, or a batch of courses, from the 'courses' collection in the 'testApp' database.
 
-    This route expects a JSON payload with the following field:
+    This route expects a JSON payload with one of the following fields:
     - _id (str): The ID of the course to be deleted.
+    - ids (list of str): The IDs of the courses to be deleted.
 
     Returns:
-    - 200 OK: If the course is successfully deleted from the collection.
+    - 200 OK: If the courses are successfully deleted from the collection. For ids, with the number of courses
+      deleted.
+    - 400 Bad Request: If the _id or ids are missing or invalid.
     """
-    response = request.get_json()
-    id = response["_id"]
+    result = collectionCourses.delete_many({"_id": {"$in": get_ids(data)}})  # finds courses by ObjectID, deletes them
 
-    collectionCourses.delete_one({
-        "_id": ObjectId(id)  # finds course based on ObjectID and deletes it
-    })
-
-    return '', 200  # OK
+    bump_version(collectionCourses)
+    return delete_response(data, result.deleted_count)
 
 
-@app.route("/course", methods=['PATCH'])
-def update_course():
+@api.route("/course", methods=['PATCH'])
+@validated(course_update_schema, allow_partial=True)
+def update_course(data):
     """
     Updates an existing course in the 'courses' collection in the 'testApp' database.
 
@@ -658,69 +2184,380 @@ def update_course():
     - courseName (str): The updated name of the course.
     - students (list of str): A list of updated student IDs enrolled in the course.
 
+    Query Parameters:
+    - partial (str): If "true", only the _id and the fields that changed need to be given.
+
     Returns:
     - 200 OK: If the course is successfully updated in the collection.
     - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+    - 404 Not Found: If no course has the given ID.
     """
-    # checks the schema to verify or validate that all the necessary fields are given in the json file
-    response = request.get_json()
-    try:
-        result = CourseCreationRequestBodySchema().load(response)
-    except ValidationError as err:
-        return '', 400  # bad request
-
-    student = response["students"]
-    listOfStudents = []
-    for x in student:
-        listOfStudents.append(ObjectId(x))  # Given list of student ids as strings, add them to list as ObjectIDs
-
-    id = response["_id"]
-    collectionCourses.update_one({"_id": ObjectId(id)},  # finds by ObjectId
-                                 {"$set": {"courseName": response["courseName"]}})  # change fields
-    collectionCourses.update_one({"_id": ObjectId(id)},
-                                 {"$set": {"students": listOfStudents}})
+    course_id = data.pop("_id")
+    if not data:
+        return '', 400  # bad request, nothing to update
+
+    result = collectionCourses.update_one({"_id": course_id},  # finds by ObjectId
+                                          {"$set": data})  # change fields
+    if result.matched_count == 0:
+        return '', 404  # Not found
+    bump_version(collectionCourses)
+    return '', 200  # OK
+
+
+@api.route("/course/students", methods=['PATCH'])
+@validated(roster_update_schema)
+def update_course_students(data):
+    """Adds students to, and removes students from, an existing course in the 'courses' collection in the 'testApp'
+    database, without sending its whole list of students.
+
+    This route expects a JSON payload with the following fields:
+    - _id (str): The ID of the course.
+    - add (list of str): The IDs of the students to add. Students already in the course are skipped.
+    - remove (list of str): The IDs of the students to remove.
+
+    Returns:
+    - 200 OK: If the students of the course are successfully updated.
+    - 400 Bad Request: If the JSON payload does not contain all the necessary fields or has invalid data types.
+    - 404 Not Found: If no course has the given ID.
+    """
+    course_updates = get_course_roster_update(data)
+    # $pull and $addToSet cannot change the same array in one update, so they are sent as one ordered bulk write
+    result = collectionCourses.bulk_write([UpdateOne({"_id": data["_id"]}, update) for update in course_updates])
+    if result.matched_count == 0:
+        return '', 404  # Not found
+    bump_version(collectionCourses)
     return '', 200  # OK
 
 
-@app.route("/course", methods=['GET'])  # method used in insomnia
+@api.route("/course", methods=['GET'])  # method used in insomnia
 def get_course():
     """Retrieves course data from the 'courses' collection in the 'testApp' database based on query parameters.
 
     Query Parameters:
     - courseName (str): The name of the course to retrieve.
+    - limit (int): The number of documents per page. Turns on pagination.
+    - next (str): The token of the next page, given in the previous page. Turns on pagination.
+    - stream (str): If "true" (and without pagination), the JSON array is streamed as it is read.
+    - fields (str): A comma-separated list of the fields to return.
+    - view (str): "summary" returns the courses without their list of students.
 
     Returns:
     - 200 OK: A JSON array containing the course data that matches the query parameters.
+      With pagination, a JSON object with the page of data in "data" and the token of the next page in "next".
+    - 400 Bad Request: If the limit, the next token, the _id or the requested fields are invalid.
+    """
+    try:
+        query_filter = get_course_filter(request.args)
+    except ValueError as err:
+        return json.dumps({"error": str(err)}), 400  # bad request
+    return find_documents(collectionCourses, query_filter)
+
+
+def get_course_filter(args):
+    """Builds the filter of get_course from its query parameters.
+
+    :param args: The query parameters of the request.
+    :return: The filter.
+    :raise: ValueError if the _id is invalid.
     """
     # gets course name from given query parameter
-    courseName = request.args.get('courseName')
-    id = request.args.get('_id')
+    courseName = args.get('courseName')
+    id = args.get('_id')
 
     # filters through the database, obtaining only the information that matches the query parameters
     query_filter = {}
     if courseName is not None:
         query_filter["courseName"] = courseName
     if id is not None:
-        query_filter["_id"] = id
+        query_filter["_id"] = parse_object_id(id)
+    return query_filter
 
-    cursor = collectionCourses.find(query_filter)
 
-    # add all the found courses that matches the query parameters into a list
-    data = []
-    for doc in cursor:
-        data.append(doc)
+####################  Authentication #######################
 
-    # removes the $oid from each _id to simplify the processes for the frontend
-    json_data = []
-    for doc in data:
-        json_data.append(flatten_oid(doc))
+# The Microsoft endpoints used by the login flow. They can be pointed at a local stub server for testing.
+entra_login_url = environ.get("ENTRA_LOGIN_URL") or "https://login.microsoftonline.com"
+graph_url = environ.get("GRAPH_URL") or "https://graph.microsoft.com"
 
-    return json_data, 200  # OK
+# connect and read timeouts (in seconds) of the calls to Microsoft, so that a hung call cannot hold a worker forever
+http_timeout = (float(environ.get("HTTP_CONNECT_TIMEOUT") or 3.05), float(environ.get("HTTP_READ_TIMEOUT") or 10))
 
 
-####################  Authentication #######################
+def create_http_session():
+    """Creates the HTTP session shared by all the calls to Microsoft. It keeps its connections open (and their TLS
+    sessions) between requests, so most logins do not need a new TCP and TLS handshake.
+
+    Failed connections are retried up to HTTP_RETRIES times, with an exponential backoff and random jitter.
+    GET requests are also retried on 429 and 5xx responses; POST requests are not, as an authorization code can only
+    be redeemed once.
 
-@app.route("/entra-id/flow", methods=['GET'])
+    :return: The session.
+    """
+    retry = Retry(
+        total=int(environ.get("HTTP_RETRIES") or 2),
+        backoff_factor=0.2,
+        backoff_jitter=0.2,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False,  # the last response is returned, and raise_for_status raises its HTTPError
+    )
+    adapter = HTTPAdapter(max_retries=retry,
+                          pool_connections=4,
+                          pool_maxsize=int(environ.get("HTTP_POOL_SIZE") or 10))
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+http_session = create_http_session()
+
+
+class LatencyMetrics:
+    """Records the duration of calls, by name, and summarizes them for the /admin/metrics route.
+
+    :param window: The number of most recent durations kept per name to compute percentiles.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, failed):
+        """Records one call.
+
+        :param name: The name of the call.
+        :param seconds: How long the call took.
+        :param failed: Whether the call raised an error.
+        """
+        with self._lock:
+            calls = self._calls.setdefault(name, {"count": 0, "errors": 0, "recent": deque(maxlen=self.window)})
+            calls["count"] += 1
+            calls["errors"] += int(failed)
+            calls["recent"].append(seconds * 1000)
+
+    def summary(self):
+        """:return: For each name, the number of calls and errors, and the median, 99th percentile and maximum
+                    duration in milliseconds of the recent calls."""
+        with self._lock:
+            report = {}
+            for name, calls in self._calls.items():
+                recent = sorted(calls["recent"])
+                report[name] = {
+                    "count": calls["count"],
+                    "errors": calls["errors"],
+                    "p50_ms": round(recent[len(recent) // 2], 2),
+                    "p99_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.99))], 2),
+                    "max_ms": round(recent[-1], 2),
+                }
+            return report
+
+
+http_metrics = LatencyMetrics()
+
+
+def http_call(name, method, url, **kwargs):
+    """Sends a request with the shared HTTP session and records its duration in http_metrics.
+
+    :param name: The name the call is recorded under.
+    :param method: The HTTP method.
+    :param url: The URL.
+    :param kwargs: The other arguments of requests.Session.request.
+    :return: The response.
+    :raise: requests.exceptions.RequestException if the request fails.
+    """
+    start = time.perf_counter()
+    failed = True
+    try:
+        response = http_session.request(method, url, timeout=http_timeout, **kwargs)
+        failed = response.status_code >= 400
+        return response
+    finally:
+        http_metrics.record(name, time.perf_counter() - start, failed)
+
+
+# The number of logins that can wait on Microsoft at the same time, which should stay below the number of worker
+# threads so that the other routes always have threads left. 0 removes the limit. When they are all taken, up to
+# LOGIN_QUEUE more logins wait up to LOGIN_WAIT seconds for one to be free; a waiting login holds its thread too, so
+# LOGIN_CONCURRENCY + LOGIN_QUEUE should also stay below the number of worker threads.
+login_concurrency = int(environ.get("LOGIN_CONCURRENCY") or 4)
+login_slots = threading.BoundedSemaphore(login_concurrency) if login_concurrency > 0 else None
+login_queue = threading.BoundedSemaphore(int(environ.get("LOGIN_QUEUE") or 2))
+login_wait = float(environ.get("LOGIN_WAIT") or 2)
+
+
+def acquire_login_slot():
+    """Takes one of the login_slots for authenticate_user, waiting up to LOGIN_WAIT seconds for one if there is room
+    in the login queue.
+
+    :return: Whether a slot was taken (always true when there is no limit).
+    """
+    if login_slots is None or login_slots.acquire(blocking=False):
+        return True
+    if not login_queue.acquire(blocking=False):
+        return False
+    try:
+        return login_slots.acquire(timeout=login_wait)
+    finally:
+        login_queue.release()
+
+# The Microsoft Graph profiles of recently logged in users, keyed by their tenant and object ID, so that a user
+# logging in again within PROFILE_CACHE_TTL seconds does not need another call to Graph. DELETE /admin/profile-cache
+# invalidates it in every worker process.
+profile_cache = SharedCache("profileCache", int(environ.get("PROFILE_CACHE_SIZE") or 2048),
+                            float(environ.get("PROFILE_CACHE_TTL") or 3600))
+
+
+def request_access_token(code):
+    """Exchanges an authorization code for an OAuth token at Microsoft's token endpoint. It blocks until Microsoft
+    answers, so the asyncio application runs it in its login thread pool.
+
+    :param code: The authorization code given to the client by Microsoft.
+    :return: The access token, and the user's ID (see get_user_id).
+    :raise: requests.exceptions.RequestException if the call fails.
+    """
+    resp = http_call("entra_token", "POST", f"{entra_login_url}/{environ.get("ENTRA_TENANT_ID")}/oauth2/v2.0/token",
+                     data={
+                         "client_id": environ.get("ENTRA_CLIENT_ID"),
+                         "client_secret": environ.get("ENTRA_CLIENT_SECRET"),
+                         "code": code,
+                         "redirect_uri": environ.get("ENTRA_REDIRECT_URI"),
+                         "grant_type": "authorization_code",
+                         "scope": "openid User.Read"
+                     })
+    resp.raise_for_status()
+    return resp.json()["access_token"], get_user_id(resp.json())
+
+
+def request_user_info(access_token):
+    """Gets the profile of the user from Microsoft Graph. Like request_access_token, it blocks until Graph answers.
+
+    :param access_token: The access token of the user.
+    :return: The part of the profile the login needs, a dictionary with the jobTitle.
+    :raise: requests.exceptions.RequestException if the call fails.
+    """
+    resp = http_call("graph_me", "GET", f"{graph_url}/v1.0/me", headers={
+        "Authorization": f"Bearer {access_token}"
+    })
+    resp.raise_for_status()
+    return {"jobTitle": resp.json().get("jobTitle") or ""}  # only what the login needs is kept
+
+
+def get_user_id(token_response):
+    """Reads the stable identifier of the user from the ID token of a token response. The ID token comes straight
+    from Microsoft's token endpoint over TLS, so its signature does not need to be checked here.
+
+    :param token_response: The JSON body of the token response.
+    :return: The user's tenant and object IDs as "tid:oid", or None if there is no usable ID token.
+    """
+    try:
+        payload = token_response["id_token"].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return f"{claims['tid']}:{claims['oid']}"
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+# The role and expiry time of recently seen session tokens ((None, None) for tokens with no session), so that most
+# requests are authenticated without a query to the sessions collection. A session deleted from the database
+# before it expires can still be used until its cache entry expires, or until DELETE /admin/session-cache
+# invalidates the cache in every worker process.
+session_cache = SharedCache("sessionCache", int(environ.get("SESSION_CACHE_SIZE") or 1024),
+                            float(environ.get("SESSION_CACHE_TTL") or 300))
+
+# The routes that can be used without being logged in
+PUBLIC_ENDPOINTS = {"api.get_consent_form_url", "api.authenticate_user"}
+# The administration routes, which need the ADMIN_TOKEN (see check_admin_token) whether or not AUTH_REQUIRED is set
+ADMIN_ENDPOINTS = {"api.get_metrics", "api.get_index_report", "api.clear_profile_cache", "api.clear_session_cache"}
+admin_token = environ.get("ADMIN_TOKEN")
+
+
+def get_session_role(session_token):
+    """Finds the role of the user a session token belongs to, from session_cache or else the sessions collection.
+
+    :param session_token: The value of the session cookie.
+    :return: "teacher" or "student", or None if there is no such session.
+    """
+    session_cache.sync(get_version(session_cache))
+    cached = session_cache.get(session_token)
+    if cached is None:
+        session = collectionSessions.find_one({"session": session_token}, {"_id": 0, "role": 1, "createdAt": 1})
+        cached = get_session_cache_entry(session)
+        session_cache.set(session_token, cached)
+    return get_live_role(cached)
+
+
+def get_session_cache_entry(session):
+    """Builds the session_cache entry of a session read from the sessions collection.
+
+    :param session: The session, with its role and createdAt, or None if there is no such session.
+    :return: The role and expiry time of the session, or (None, None) if there is no usable session.
+    """
+    if session is None or session.get("createdAt") is None:
+        return None, None
+    created_at = session["createdAt"].replace(tzinfo=timezone.utc)  # pymongo returns naive UTC datetimes
+    return session["role"], created_at + timedelta(seconds=session_ttl)
+
+
+def get_live_role(cached):
+    """:return: The role of a session_cache entry, or None if there is no session or it has expired."""
+    role, expires_at = cached
+    if role is None or expires_at <= datetime.now(timezone.utc):
+        return None
+    return role
+
+
+@api.before_app_request
+def check_session():
+    """Resolves the session cookie of every request to the role of the user, stored in g.role (None when the
+    request has no valid session).
+
+    When AUTH_REQUIRED is "true", requests without a valid session are rejected, except for the login flow and
+    CORS preflight requests, and students can only use GET routes. The administration routes always need the
+    admin token instead (see check_admin_token).
+
+    Returns:
+    - None: If the request can go on to its route.
+    - 401 Unauthorized: If the request has no valid session, or no valid admin token for an administration route.
+    - 403 Forbidden: If a student uses a route that changes data, or ADMIN_TOKEN is not set for an administration
+      route.
+    """
+    session_token = request.cookies.get("session")
+    g.role = get_session_role(session_token) if session_token else None
+
+    if request.method == "OPTIONS":
+        return None
+    if request.endpoint in ADMIN_ENDPOINTS:
+        return check_admin_token()
+    if not auth_required or request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    if request.endpoint is None:  # no such route, Flask answers 404
+        return None
+    if g.role is None:
+        return json.dumps({"error": "Not logged in"}), 401  # Unauthorized
+    if g.role != "teacher" and request.method != "GET":
+        return json.dumps({"error": "Only teachers can change data"}), 403  # Forbidden
+    return None
+
+
+def check_admin_token():
+    """Checks the admin token of a request to an administration route, given in an "Authorization: Bearer <token>"
+    header. A teacher's session is not enough: these routes clear caches and report on the whole database.
+
+    Returns:
+    - None: If the token matches ADMIN_TOKEN.
+    - 401 Unauthorized: If the token is missing or wrong.
+    - 403 Forbidden: If ADMIN_TOKEN is not set, which turns the administration routes off.
+    """
+    if not admin_token:
+        return json.dumps({"error": "The administration routes are turned off"}), 403  # Forbidden
+    scheme, _, token = (request.headers.get("Authorization") or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), admin_token.encode()):
+        return json.dumps({"error": "Invalid admin token"}), 401  # Unauthorized
+    return None
+
+
+@api.route("/entra-id/flow", methods=['GET'])
 def get_consent_form_url():
     """This route generates a state document in the MongoDB collection 'OAuthStates.'
 
@@ -731,81 +2568,244 @@ def get_consent_form_url():
     state_token = str(uuid4())
     collectionOAuthStates.insert_one({
         "state": state_token,
-        "status": "pending"
+        "status": "pending",
+        "createdAt": datetime.now(timezone.utc)  # the state token expires oauth_state_ttl seconds after this
     })
 
-    return redirect(
-        f"https://login.microsoftonline.com/{environ.get("ENTRA_TENANT_ID")}/oauth2/v2.0/authorize?client_id={environ.get('ENTRA_CLIENT_ID')}&response_type=code&redirect_uri={environ.get('ENTRA_REDIRECT_URI')}&response_mode=query&scope=User.Read&state={state_token}")
+    return redirect(get_consent_form_location(state_token))
 
 
-@app.route("/entra-id/flow", methods=['POST'])
+def get_consent_form_location(state_token):
+    """:return: The URL of the Microsoft login page for a state token, where get_consent_form_url redirects."""
+    return f"{entra_login_url}/{environ.get("ENTRA_TENANT_ID")}/oauth2/v2.0/authorize?client_id={environ.get('ENTRA_CLIENT_ID')}&response_type=code&redirect_uri={environ.get('ENTRA_REDIRECT_URI')}&response_mode=query&scope=openid%20User.Read&state={state_token}"
+
+
+@api.route("/entra-id/flow", methods=['POST'])
 def authenticate_user():
     """Authenticates the user using the OAuth 2.0 authorization code flow with Microsoft Azure Active Directory
-    It first verifies the state token provided in the request JSON payload with the state token stored in the 'OAuthStates' collection in MongoDB
-    It then exchanges the authorization code for an OAuth token and retrieves
-    user information from Microsoft Graph API. If successful, it creates a session token and sets a session cookie.
+    (see log_in_user).
+
+    A login waits on two calls to Microsoft, which keeps its worker thread busy for as long as they take. So that a
+    burst of logins cannot take every worker thread and leave the other routes waiting, at most LOGIN_CONCURRENCY
+    logins run at once; up to LOGIN_QUEUE others wait up to LOGIN_WAIT seconds for one of them to finish (see
+    acquire_login_slot), and the rest are turned away with a 503 and a Retry-After header. The asyncio application
+    (async_main.py) serves this route without the limit, as its logins wait on Microsoft without holding a thread.
 
     Returns:
     - 200 OK: If the user is successfully authenticated and a session cookie is set.
     - 400 Bad Request: If there is an error in the authentication process or the state token is invalid.
-    - 500 Internal Server Error: If there is an issue updating the state token in the database.
+    - 503 Service Unavailable: If too many logins are in progress, and still are after LOGIN_WAIT seconds.
     """
-    # verify state token
+    if not acquire_login_slot():
+        resp = make_response(json.dumps({"error": "Too many logins in progress, try again shortly"}), 503)
+        resp.headers["Retry-After"] = "1"
+        return resp
+    try:
+        return log_in_user()
+    finally:
+        if login_slots is not None:
+            login_slots.release()
+
+
+def log_in_user():
+    """Runs the OAuth 2.0 authorization code flow with Microsoft Azure Active Directory for authenticate_user.
+    It first claims the state token provided in the request JSON payload in the 'OAuthStates' collection in MongoDB,
+    moving it from pending to in-flight in a single atomic update, so that the same state token cannot be redeemed
+    twice at once. It then exchanges the authorization code for an OAuth token and retrieves
+    user information from Microsoft Graph API (unless it is in profile_cache). If successful, it marks the state token
+    as used, creates a session token and sets a session cookie. If not, the state token goes back to pending so that
+    the login can be retried.
+
+    :return: The response of the authenticate_user route.
+    """
+    # claim the state token. MongoDB only deletes expired documents once a minute, so the expiry is also checked here
     state_token = request.get_json()["state"]
-    state = collectionOAuthStates.find_one({"state": state_token})
+    expired_before = datetime.now(timezone.utc) - timedelta(seconds=oauth_state_ttl)
+    state = collectionOAuthStates.find_one_and_update({
+        "state": state_token,
+        "status": "pending",
+        "createdAt": {"$gt": expired_before}
+    }, {"$set": {"status": "in-flight"}})
     if state is None:
-        return json.dumps({"error": "Invalid state token"}), 400
+        # only on failure, find out why to give the right error
+        state = collectionOAuthStates.find_one({"state": state_token}, {"status": 1, "createdAt": 1})
+        return json.dumps({"error": get_state_error(state, expired_before)}), 400
 
-    if state["status"] != "pending":
-        return json.dumps({"error": "State token has already been used"}), 400
+    def release_state():
+        """Puts the claimed state token back to pending after a failed login."""
+        collectionOAuthStates.update_one({"state": state_token, "status": "in-flight"},
+                                         {"$set": {"status": "pending"}})
 
     # get oauth token 
     try:
-        resp = requests.post(f"https://login.microsoftonline.com/{environ.get("ENTRA_TENANT_ID")}/oauth2/v2.0/token",
-                             data={
-                                 "client_id": environ.get("ENTRA_CLIENT_ID"),
-                                 "client_secret": environ.get("ENTRA_CLIENT_SECRET"),
-                                 "code": request.get_json()["code"],
-                                 "redirect_uri": environ.get("ENTRA_REDIRECT_URI"),
-                                 "grant_type": "authorization_code",
-                                 "scope": "User.Read"
-                             })
-        resp.raise_for_status()
-        access_token = resp.json()["access_token"]
-    except requests.exceptions.HTTPError as e:
+        access_token, user_id = request_access_token(request.get_json()["code"])
+    except requests.exceptions.RequestException as e:
+        release_state()
         return json.dumps({"error": "Failed to authenticate user"}), 400
 
-    # get user info
-    try:
-        resp = requests.get("https://graph.microsoft.com/v1.0/me", headers={
-            "Authorization": f"Bearer {access_token}"
-        })
-        resp.raise_for_status()
-        user_info = resp.json()
-    except requests.exceptions.HTTPError as e:
-        return json.dumps({"error": "Failed to get user info"}), 400
-
-    # set state token to used
-    try:
-        collectionOAuthStates.update_one({"state": state_token}, {"$set": {"status": "used"}})
-    except:
-        return json.dumps({"error": "Failed to update state token"}), 500
+    # get user info, from the profile cache if the user logged in recently
+    profile_cache.sync(get_version(profile_cache))
+    user_info = profile_cache.get(user_id) if user_id is not None else None
+    if user_info is None:
+        try:
+            user_info = request_user_info(access_token)
+        except requests.exceptions.RequestException as e:
+            release_state()
+            return json.dumps({"error": "Failed to get user info"}), 400
+        if user_id is not None:
+            profile_cache.set(user_id, user_info)
+
+    # set state token to used. The token can no longer be claimed once it is in-flight, so there is no need to
+    # wait for this write to be acknowledged
+    collectionOAuthStates.with_options(write_concern=WriteConcern(w=0)).update_one(
+        {"state": state_token}, {"$set": {"status": "used"}})
 
     # create a session document in mongodb
-    session_token = str(uuid4())
+    session = new_session(user_info)
+    collectionSessions.insert_one(session)
+    return set_session_cookie(make_response("Logged in"), session)
+
+
+def get_state_error(state, expired_before):
+    """Works out why a state token could not be claimed by log_in_user.
+
+    :param state: The document of the state token, with its status and createdAt, or None if there is none.
+    :param expired_before: The creation time before which state tokens have expired.
+    :return: The error message.
+    """
+    if state is None:
+        return "Invalid state token"
+    # pymongo returns the dates without a timezone, in UTC
+    if state["status"] == "pending" and state["createdAt"].replace(tzinfo=timezone.utc) <= expired_before:
+        return "State token has expired"
+    return "State token has already been used"
+
+
+def new_session(user_info):
+    """Builds the document of a new session for a user who just logged in.
+
+    :param user_info: The profile of the user (see request_user_info).
+    :return: The document to insert, with a new session token and the user's role.
+    """
     role = "teacher"
     if "Student" in user_info["jobTitle"]:
         role = "student"
-
-    collectionSessions.insert_one({
-        "session": session_token,
+    return {
+        "session": str(uuid4()),
         "role": role,
-    })
+        "createdAt": datetime.now(timezone.utc)  # the session expires session_ttl seconds after this
+    }
+
+
+def set_session_cookie(resp, session):
+    """Caches a new session and sets its cookie on the response of a successful login.
+
+    :param resp: The response.
+    :param session: The document of the session, once inserted.
+    :return: The response.
+    """
+    session_cache.set(session["session"], (session["role"], session["createdAt"] + timedelta(seconds=session_ttl)))
+    # the cookie is hidden from scripts and only sent over HTTPS
+    resp.set_cookie("session", session["session"], max_age=session_ttl, httponly=True, secure=True,
+                    samesite=session_cookie_samesite)
+    return resp
+
+
+####################  Administration  #######################
+
+# Every route of this section needs the admin token (see check_admin_token)
+
+@api.route("/admin/metrics", methods=['GET'])
+def get_metrics():
+    """Reports metrics about the application.
+
+    Returns:
+    - 200 OK: A JSON object with "collections", the number of live documents in each collection whose documents
+      expire (from the collection metadata, without counting them one by one), and "http", the number, errors and
+      latency of the calls to Microsoft.
+    """
+    return {
+        "collections": {collection.name: collection.estimated_document_count() for collection in EXPIRING_COLLECTIONS},
+        "http": http_metrics.summary(),
+    }, 200  # OK
+
+
+@api.route("/admin/indexes", methods=['GET'])
+def get_index_report():
+    """Reports the state of the indexes declared in INDEXES.
+
+    Returns:
+    - 200 OK: A JSON object keyed by collection name, listing the missing and the unused indexes of each collection.
+    """
+    return index_report(), 200  # OK
+
+
+@api.route("/admin/profile-cache", methods=['DELETE'])
+def clear_profile_cache():
+    """Removes Microsoft Graph profiles from the profile cache, so that the next login of the user reads their
+    profile (and role) from Graph again. The other worker processes clear their whole profile cache within
+    VERSION_SYNC_INTERVAL seconds (see SharedCache).
+
+    This route accepts an optional JSON payload with the following field:
+    - user (str): The "tid:oid" identifier of the user whose profile should be removed. Every profile is removed
+      if it is not given.
+
+    Returns:
+    - 200 OK: If the profiles are removed.
+    """
+    response = request.get_json(silent=True) or {}
+    profile_cache.invalidate(response.get("user"))
+    return '', 200  # OK
+
+
+@api.route("/admin/session-cache", methods=['DELETE'])
+def clear_session_cache():
+    """Clears the session cache of every worker process (within VERSION_SYNC_INTERVAL seconds), so that sessions
+    deleted from the sessions collection stop working straight away instead of when their cache entry expires.
+
+    Returns:
+    - 200 OK: If the session cache is cleared.
+    """
+    session_cache.invalidate()
+    return '', 200  # OK
+
+
+####################  Application  #######################
+
+def get_cors_settings():
+    """Gives the Flask-CORS settings of the application. Browsers only send the session cookie with cross-origin
+    requests when credentials are allowed, so they are only allowed for the origins listed in CORS_ORIGINS: with
+    credentials, Flask-CORS would otherwise echo back the origin of any web page.
+
+    :return: The keyword arguments of Flask-CORS.
+    :raise: RuntimeError if AUTH_REQUIRED is "true" but CORS_ORIGINS is not set.
+    """
+    if not auth_required:
+        return {"origins": cors_origins or "*"}
+    if not cors_origins:
+        raise RuntimeError("CORS_ORIGINS must list the origins allowed to send the session cookie "
+                           "when AUTH_REQUIRED is true")
+    return {"origins": cors_origins, "supports_credentials": True}
+
+
+def create_app():
+    """Creates the Flask application serving the routes of this module, with CORS enabled (see get_cors_settings),
+    and starts building the indexes in a background thread unless CREATE_INDEXES is "false".
+
+    A pre-fork server calls this in each worker after it is forked (see wsgi.py), so the MongoClient and the index
+    bootstrap thread belong to the worker.
+
+    :return: The Flask application.
+    """
+    app = Flask(__name__)
+    app.register_blueprint(api)
+    CORS(app, **get_cors_settings())
 
-    resp = make_response("Logged in")
-    resp.set_cookie("session", session_token)
+    if environ.get("CREATE_INDEXES") != "false":
+        threading.Thread(target=bootstrap_indexes, name="index-bootstrap", daemon=True).start()
+    return app
 
 
-# Runs the whole application
+# Runs the whole application on the Flask development server (see gunicorn.conf.py for production)
 if __name__ == "__main__":
-    app.run(debug=environ.get("DEBUG") == "true", port=3000, host=environ.get("HOST") or "127.0.0.1")
+    create_app().run(debug=environ.get("DEBUG") == "true", port=3000, host=environ.get("HOST") or "127.0.0.1")
@@ -0,0 +1,4 @@
+"""The WSGI entry point of the application for production servers: gunicorn -c gunicorn.conf.py wsgi:app"""
+from main import create_app
+
+app = create_app()